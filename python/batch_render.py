@@ -0,0 +1,191 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gg
+
+# Renders many JSON configs on a bounded process pool and records a manifest.
+#
+#   python batch_render.py configs/ "more/*.json" --out-dir renders --workers 4
+#   python batch_render.py configs/ --out-dir renders --resume
+#   python batch_render.py track.json --takes 20   # renders/track_take01.wav ...
+#
+# Outputs mirror the input layout under --out-dir. The manifest is rewritten
+# after every file, so --resume after a crash skips files already rendered from
+# an unchanged config with the same options and seed.
+
+MANIFEST_VERSION = 1
+
+def find_configs(patterns):
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, "**", "*.json"), recursive=True))
+        else:
+            paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in paths)
+
+def output_path(config_path, base_dir, out_dir):
+    relative = os.path.relpath(config_path, base_dir)
+    return os.path.join(out_dir, os.path.splitext(relative)[0] + ".wav")
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def file_seed(seed, relative):
+    # Per-file seed derived from the batch seed and the config's relative path
+    if seed is None:
+        return None
+    digest = hashlib.sha256(f"{seed}:{relative}".encode()).digest()
+    return int.from_bytes(digest[:4], "little")
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise SystemExit(f"Unsupported manifest version in {path}")
+    return manifest
+
+def save_manifest(manifest, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def render_one(config_path, output_file, seed, options):
+    # Runs in a worker; the synthesizer (and its caches) persists per process
+    start = time.perf_counter()
+    entry = {"input": config_path, "output": output_file, "seed": seed}
+    try:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        sample_rate = config.get("sample_rate", 44100)
+        quality = options.get("quality", "normal")
+        synth = gg.cached_synth(gg.render_rate(sample_rate, quality), options["oscillator"], options["interpolation"],
+                                options["note_cache_bytes"], options["dtype"], options["percussion"],
+                                options.get("noise_bank_bytes", 0), quality)
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        takes = options.get("takes", 1)
+        if takes > 1:
+            # Humanized takes sharing their notes, in one call
+            pattern = os.path.splitext(output_file)[0] + "_take{take:02d}.wav"
+            outputs = gg.create_variations(config_path, pattern, takes, seed=seed, batch=options["batch"],
+                                           synth=synth, note_cache_bytes=options["note_cache_bytes"],
+                                           quality=quality)
+            entry["outputs"] = [path for path, _ in outputs]
+        else:
+            gg.create_advanced_music(config_path, output_file, seed=seed, batch=options["batch"],
+                                     stream=options["stream"], synth=synth,
+                                     note_cache_bytes=options["note_cache_bytes"], quality=quality,
+                                     loop_bake=options.get("loop_bake", False))
+        entry["status"] = "done"
+        entry["audio_seconds"] = config["total_duration"] * takes
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+        entry["traceback"] = traceback.format_exc()
+    entry["wall_time"] = time.perf_counter() - start
+    if entry.get("audio_seconds"):
+        entry["realtime_factor"] = entry["audio_seconds"] / entry["wall_time"]
+    # ru_maxrss is in kilobytes on Linux; it is the worker's peak so far
+    entry["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    entry["worker_pid"] = os.getpid()
+    return entry
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render many music configs to WAV.")
+    parser.add_argument("inputs", nargs="+", help="config files, directories or glob patterns")
+    parser.add_argument("--out-dir", default="renders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--manifest", help="manifest path (default: <out-dir>/manifest.json)")
+    parser.add_argument("--resume", action="store_true", help="skip files the manifest records as done")
+    parser.add_argument("--seed", type=int, help="batch seed; each file gets a seed derived from it")
+    parser.add_argument("--batch", action="store_true", help="use the batched per-instrument renderer")
+    parser.add_argument("--stream", action="store_true", help="stream each render in constant memory")
+    parser.add_argument("--oscillator", choices=["sine", "wavetable"], default="sine")
+    parser.add_argument("--interpolation", choices=["linear", "cubic"], default="linear")
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64",
+                        help="synthesis and mixing precision")
+    parser.add_argument("--percussion", choices=["notes", "trains"], default="notes",
+                        help="render drum hits one by one or as trigger trains of cached takes")
+    parser.add_argument("--note-cache-mb", type=int, default=gg.DEFAULT_NOTE_CACHE_BYTES // (1024 * 1024))
+    parser.add_argument("--quality", choices=list(gg.QUALITY_LEVELS), default="normal",
+                        help="draft renders at a quarter of the rate for previews; high oversamples 2x")
+    parser.add_argument("--noise-bank-mb", type=int, default=0,
+                        help="read note noise from a shared precomputed bank of this size (0 draws fresh noise)")
+    parser.add_argument("--takes", type=int, default=1,
+                        help="write this many humanized takes of each config, synthesizing shared notes once")
+    parser.add_argument("--loop-bake", action="store_true",
+                        help="render looping instruments as a few takes of their cycle, tiled over the song")
+    args = parser.parse_args(argv)
+    if args.loop_bake and args.stream:
+        parser.error("--loop-bake cannot be combined with --stream")
+    if args.takes > 1 and (args.stream or args.loop_bake):
+        parser.error("--takes renders in memory and cannot be combined with --stream or --loop-bake")
+
+    manifest_path = args.manifest or os.path.join(args.out_dir, "manifest.json")
+    configs = [path for path in find_configs(args.inputs) if path != os.path.abspath(manifest_path)]
+    if not configs:
+        print("No configs found")
+        return 1
+    base_dir = os.path.commonpath([os.path.dirname(path) for path in configs])
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest = load_manifest(manifest_path) if args.resume else {"version": MANIFEST_VERSION, "files": {}}
+    options = {"batch": args.batch, "stream": args.stream, "oscillator": args.oscillator,
+               "interpolation": args.interpolation, "note_cache_bytes": args.note_cache_mb * 1024 * 1024,
+               "dtype": args.dtype, "percussion": args.percussion,
+               "noise_bank_bytes": args.noise_bank_mb * 1024 * 1024, "quality": args.quality,
+               "takes": max(1, args.takes), "loop_bake": args.loop_bake}
+    manifest["options"] = dict(options, seed=args.seed, workers=args.workers)
+
+    pending = []
+    for config_path in configs:
+        relative = os.path.relpath(config_path, base_dir)
+        output_file = output_path(config_path, base_dir, args.out_dir)
+        digest = file_sha256(config_path)
+        done = manifest["files"].get(relative, {})
+        # Only a render from the same config, options and seed is reused
+        if (args.resume and done.get("status") == "done" and done.get("config_sha256") == digest
+                and done.get("options") == options and done.get("seed") == file_seed(args.seed, relative)
+                and all(os.path.exists(path) for path in done.get("outputs", [done.get("output", "")]))):
+            print(f"Skipping {relative} (already rendered)")
+            continue
+        pending.append((relative, config_path, output_file, digest))
+
+    batch_start = time.perf_counter()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(render_one, config_path, output_file, file_seed(args.seed, relative), options):
+                   (relative, digest)
+                   for relative, config_path, output_file, digest in pending}
+        for future in as_completed(futures):
+            relative, digest = futures[future]
+            entry = future.result()
+            entry["config_sha256"] = digest
+            entry["options"] = options
+            manifest["files"][relative] = entry
+            save_manifest(manifest, manifest_path)
+            if entry["status"] == "done":
+                print(f"{relative}: {entry['wall_time']:.2f}s ({entry['realtime_factor']:.1f}x realtime)")
+            else:
+                failures += 1
+                print(f"{relative}: {entry['error']}")
+
+    manifest["last_run"] = {"files": len(pending), "failures": failures,
+                            "wall_time": time.perf_counter() - batch_start}
+    save_manifest(manifest, manifest_path)
+    print(f"Rendered {len(pending) - failures}/{len(pending)} files, manifest at {manifest_path}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+import gg
+
+# Reproducible performance suite for the synthesizer and full renders.
+#
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --out current.json --compare baseline.json
+#   python benchmark.py --input current.json --compare baseline.json   # no rerun
+#
+# Every measurement is seeded, so two runs do the same work. Times are the best
+# of --repeats runs; peak memory comes from tracemalloc on one extra run, so
+# tracing never slows down a timed run. --compare exits with 1 on regressions.
+
+RESULTS_VERSION = 1
+SEED = 1234
+
+GENERATORS = [
+    ("generate_violin", lambda synth, freq, duration: synth.generate_violin(freq, duration, 0.8)),
+    ("generate_cello", lambda synth, freq, duration: synth.generate_cello(freq, duration, 0.8)),
+    ("generate_acoustic_guitar", lambda synth, freq, duration: synth.generate_acoustic_guitar(freq, duration, 0.8)),
+    ("generate_bass", lambda synth, freq, duration: synth.generate_bass(freq, duration, 0.8)),
+    ("generate_piano", lambda synth, freq, duration: synth.generate_piano(freq, duration, 0.8)),
+    ("generate_drum_kick", lambda synth, freq, duration: synth.generate_drum(freq, duration, 0.8, "kick")),
+    ("generate_drum_snare", lambda synth, freq, duration: synth.generate_drum(freq, duration, 0.8, "snare")),
+    ("generate_drum_hihat", lambda synth, freq, duration: synth.generate_drum(freq, duration, 0.8, "hihat")),
+    ("generate_electric_guitar", lambda synth, freq, duration: synth.generate_electric_guitar(freq, duration, 0.8)),
+    ("generate_synth_pad", lambda synth, freq, duration: synth.generate_synth_pad(freq, duration, 0.8)),
+    ("generate_wave", lambda synth, freq, duration: gg.generate_wave(freq, duration, synth.sample_rate, 0.8)),
+]
+DURATIONS = [0.05, 0.25, 1.0, 4.0]
+NOTES = [f"C{octave}" for octave in range(10)]
+QUICK_DURATIONS = [0.25, 1.0]
+QUICK_NOTES = ["C2", "C5", "C8"]
+
+MODES = {"event": {}, "batch": {"batch": True}, "stream": {"stream": True}, "trains": {"percussion": "trains"},
+         "draft": {"quality": "draft"}, "stereo": {}, "loop_bake": {"loop_bake": True}}
+RENDER_MODES = ["event", "batch", "stream", "draft", "stereo"]
+VARIATION_TAKES = 20  # the "variations" mode writes this many takes with create_variations
+LARGE_MODES = ["stream"]  # an in-memory mix bus for the large config needs several GB
+
+def synthetic_config(instruments, total_duration, seed=SEED):
+    # Deterministic config cycling through every instrument type. Note lengths
+    # are long enough for every envelope, so no event fails.
+    rng = np.random.default_rng(seed)
+    types = ["violin", "cello", "acoustic_guitar", "bass", "piano",
+             "drum_kick", "drum_snare", "electric_guitar", "synth_pad"]
+    notes = [f"{name}{octave}" for octave in range(2, 7) for name in ("C", "D", "E", "F", "G", "A", "B")]
+    config = {"tempo": 120, "total_duration": total_duration, "sample_rate": 44100, "instruments": []}
+    for index in range(instruments):
+        pattern = [{"note": str(rng.choice(notes)), "duration": float(rng.choice([1.0, 1.5, 2.0]))}
+                   for _ in range(8)]
+        config["instruments"].append({"type": types[index % len(types)], "volume": 0.5,
+                                      "pattern": pattern, "repeat": True})
+    return config
+
+def stereo_config(config):
+    # The config panned across the stereo field, synth pads widened
+    config = json.loads(json.dumps(config))
+    count = len(config["instruments"])
+    for index, instrument in enumerate(config["instruments"]):
+        instrument["pan"] = -0.6 + 1.2 * index / max(count - 1, 1)
+        if instrument["type"] == "synth_pad":
+            instrument["width"] = 0.5
+    return config
+
+def loop_config(path, total_duration):
+    # A config of repeating patterns played for total_duration
+    with open(path) as f:
+        config = json.load(f)
+    config["total_duration"] = total_duration
+    return config
+
+def drum_config(total_duration):
+    # Eighth-note kit plus kick and snare tracks: about 14 hits per second
+    kit = [{"sound": sound, "duration": 0.125}
+           for sound in ("kick", "hihat", "hihat", "hihat", "snare", "hihat", "REST", "hihat")]
+    return {"tempo": 120, "total_duration": total_duration, "sample_rate": 44100, "instruments": [
+        {"type": "drum", "volume": 0.9, "pattern": kit, "repeat": True},
+        {"type": "drum_kick", "volume": 0.8, "pattern": [{"note": "C2", "duration": 0.25}], "repeat": True},
+        {"type": "drum_snare", "volume": 0.8, "pattern": [{"note": "C2", "duration": 0.5}], "repeat": True},
+    ]}
+
+CHORDS = [["C3", "E3", "G3", "B3"], ["A2", "C3", "E3", "G3"], ["F2", "A2", "C3", "E3"], ["G2", "B2", "D3", "F3"]]
+
+def chord_config(total_duration, duplicate=False):
+    # Four-note chords on guitar and pad, either as "notes" events or, with
+    # duplicate, as the old workaround of one instrument per chord voice
+    config = {"tempo": 120, "total_duration": total_duration, "sample_rate": 44100, "instruments": []}
+    for instrument_type, duration in (("acoustic_guitar", 0.5), ("synth_pad", 2.0)):
+        if duplicate:
+            for voice in range(len(CHORDS[0])):
+                pattern = [{"note": chord[voice], "duration": duration} for chord in CHORDS]
+                config["instruments"].append({"type": instrument_type, "volume": 0.3, "pattern": pattern,
+                                              "repeat": True})
+        else:
+            pattern = [{"notes": chord, "duration": duration} for chord in CHORDS]
+            config["instruments"].append({"type": instrument_type, "volume": 0.3, "pattern": pattern,
+                                          "repeat": True})
+    return config
+
+def large_score(instruments=100, events=2000, seed=SEED):
+    # synthetic_config with long patterns: 200,000 events by default
+    config = synthetic_config(instruments, 60, seed)
+    rng = np.random.default_rng(seed)
+    notes = [event["note"] for instrument in config["instruments"] for event in instrument["pattern"]]
+    for instrument in config["instruments"]:
+        instrument["pattern"] = [{"note": str(rng.choice(notes)), "duration": float(rng.choice([0.25, 0.5, 1.0]))}
+                                 for _ in range(events)]
+    return config
+
+def best_of(function, repeats):
+    # (best wall time, last result) of repeats calls; for the comparison scripts
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def measure(run, repeats, memory=True):
+    # Best and median wall time of repeats seeded runs, then peak traced memory
+    times = []
+    for _ in range(repeats):
+        np.random.seed(SEED)
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    result = {"best_s": min(times), "median_s": statistics.median(times)}
+    if memory:
+        np.random.seed(SEED)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def bench_generators(durations, notes, repeats, dtype):
+    # Note cache off, so every call synthesizes; the envelope table stays warm
+    synth = gg.RealisticInstrumentSynthesizer(44100, dtype=dtype)
+    rows = []
+    for name, generate in GENERATORS:
+        for duration in durations:
+            samples = int(synth.sample_rate * duration)
+            for note in notes:
+                freq = gg.NOTE_FREQ[note]
+                row = {"name": name, "duration": duration, "note": note, "freq": freq, "samples": samples}
+                try:
+                    generate(synth, freq, duration)
+                except Exception as e:
+                    # Envelopes longer than the note raise; recorded, not timed
+                    row["error"] = f"{type(e).__name__}: {e}"
+                    rows.append(row)
+                    continue
+                row.update(measure(lambda: generate(synth, freq, duration), repeats))
+                row["samples_per_s"] = samples / row["best_s"]
+                row["realtime_factor"] = duration / row["best_s"]
+                rows.append(row)
+    return rows
+
+def render_cases(large):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cases = [
+        ("track.json", os.path.join(here, "track.json"), RENDER_MODES + ["variations"]),
+        ("music_config.json", os.path.join(here, "music_config.json"), RENDER_MODES + ["variations"]),
+        ("synthetic_20x120s", synthetic_config(20, 120), RENDER_MODES),
+        ("drums_300s", drum_config(300), ["event", "trains"]),
+        ("chords_120s", chord_config(120), ["event"]),
+        ("chords_duplicated_120s", chord_config(120, duplicate=True), ["event"]),
+        ("track_600s", loop_config(os.path.join(here, "track.json"), 600), ["event", "batch", "loop_bake"]),
+        ("music_config_600s", loop_config(os.path.join(here, "music_config.json"), 600),
+         ["event", "batch", "loop_bake"]),
+    ]
+    if large:
+        cases.append(("synthetic_100x3600s", synthetic_config(100, 3600), LARGE_MODES))
+    return cases
+
+def resample_seconds(path, dtype, workdir):
+    # Time of the draft render's final resample, from one profiled run
+    profile = os.path.join(workdir, "draft.profile.json")
+    with contextlib.redirect_stdout(io.StringIO()):
+        gg.create_advanced_music(path, os.path.join(workdir, "render.wav"), seed=SEED, dtype=dtype,
+                                 quality="draft", profile=profile)
+    with open(profile, "r") as f:
+        stages = json.load(f)["stages"]
+    return stages.get("resample", {}).get("seconds", 0.0)
+
+def bench_renders(cases, repeats, dtype, workdir):
+    rows = []
+    output_file = os.path.join(workdir, "render.wav")
+    for name, source, modes in cases:
+        if isinstance(source, dict):
+            config_path = os.path.join(workdir, name + ".json")
+            with open(config_path, "w") as f:
+                json.dump(source, f)
+        else:
+            config_path = source
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        for mode in modes:
+            takes = VARIATION_TAKES if mode == "variations" else 1
+            path = config_path
+            if mode == "stereo":
+                path = os.path.join(workdir, name + ".stereo.json")
+                with open(path, "w") as f:
+                    json.dump(stereo_config(config), f)
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if mode == "variations":
+                        gg.create_variations(path, os.path.join(workdir, "take{take:02d}.wav"), takes,
+                                             seed=SEED, dtype=dtype)
+                    else:
+                        gg.create_advanced_music(path, output_file, seed=SEED, dtype=dtype, **MODES[mode])
+            row = {"name": name, "mode": mode, "instruments": len(config["instruments"]),
+                   "total_duration": config["total_duration"], "takes": takes}
+            row.update(measure(run, repeats))
+            row["realtime_factor"] = takes * config["total_duration"] / row["best_s"]
+            if mode == "draft":
+                row["resample_s"] = resample_seconds(path, dtype, workdir)
+            rows.append(row)
+            print(f"{name:<22}{mode:<11}{row['best_s']:>9.3f}s{row['realtime_factor']:>9.1f}x"
+                  f"{row['peak_bytes'] / 1e6:>10.1f} MB")
+        times = {row["mode"]: row["best_s"] for row in rows if row["name"] == name}
+        peaks = {row["mode"]: row["peak_bytes"] for row in rows if row["name"] == name}
+        if "event" in times and "draft" in times:
+            # Resampling, mastering and writing stay at the output rate, so
+            # draft only pays off when synthesis dominates the render
+            draft = next(row for row in rows if row["name"] == name and row["mode"] == "draft")
+            print(f"{name:<22}draft is {times['event'] / times['draft']:.1f}x faster than the full-quality render; "
+                  f"resampling to the output rate is {draft['resample_s'] / times['draft']:.0%} of it")
+        if "event" in times and "variations" in times:
+            print(f"{name:<22}{VARIATION_TAKES} variations are {VARIATION_TAKES * times['event'] / times['variations']:.1f}x"
+                  f" faster than {VARIATION_TAKES} renders")
+        if "event" in times and "loop_bake" in times:
+            print(f"{name:<22}loop bake is {times['event'] / times['loop_bake']:.1f}x faster and takes "
+                  f"{peaks['loop_bake'] / peaks['event']:.2f}x the memory")
+        if "event" in times and "stereo" in times:
+            print(f"{name:<22}stereo takes {times['stereo'] / times['event']:.2f}x the time and "
+                  f"{peaks['stereo'] / peaks['event']:.2f}x the memory of mono")
+    return rows
+
+def bench_loads(repeats, workdir):
+    # Startup on a large score: reading it, and reading plus compiling the
+    # timeline, from the JSON config and from the binary score
+    config = large_score()
+    paths = {"json": os.path.join(workdir, "large.json"), "binary": os.path.join(workdir, "large.score")}
+    with open(paths["json"], "w") as f:
+        json.dump(config, f)
+    gg.Score.from_config(config).save(paths["binary"])
+    events = sum(len(instrument["pattern"]) for instrument in config["instruments"])
+    rows = []
+    for file_format, path in paths.items():
+        for stage, run in (("load", lambda path=path: gg.load_score(path)),
+                           ("compile", lambda path=path: gg.compile_timeline(gg.load_score(path), seed=SEED))):
+            row = {"name": "large_score", "format": file_format, "stage": stage, "events": events,
+                   "bytes": os.path.getsize(path)}
+            row.update(measure(run, repeats))
+            rows.append(row)
+            print(f"{'large_score':<22}{file_format:<8}{stage:<9}{row['best_s'] * 1e3:>9.1f} ms"
+                  f"{row['bytes'] / 1e6:>9.1f} MB on disk")
+    return rows
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "seed": SEED,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def _generator_key(row):
+    return ("generator", row["name"], row["duration"], row["note"])
+
+def _render_key(row):
+    return ("render", row["name"], row["mode"])
+
+def _load_key(row):
+    return ("load", row["name"], row["format"], row["stage"])
+
+def compare(current, baseline, time_threshold, memory_threshold):
+    # Rows are matched by key; a regression is a slower best time or a larger
+    # memory peak beyond the relative threshold.
+    if current.get("options", {}).get("dtype") != baseline.get("options", {}).get("dtype"):
+        print("Warning: comparing runs with different dtypes")
+    previous = {}
+    for row in baseline.get("generators", []):
+        previous[_generator_key(row)] = row
+    for row in baseline.get("renders", []):
+        previous[_render_key(row)] = row
+    for row in baseline.get("loads", []):
+        previous[_load_key(row)] = row
+    regressions = []
+    matched = 0
+    rows = [(_generator_key(row), row) for row in current.get("generators", [])]
+    rows += [(_render_key(row), row) for row in current.get("renders", [])]
+    rows += [(_load_key(row), row) for row in current.get("loads", [])]
+    for key, row in rows:
+        old = previous.get(key)
+        if old is None or "best_s" not in row or "best_s" not in old:
+            continue
+        matched += 1
+        ratio = row["best_s"] / old["best_s"]
+        if ratio > 1 + time_threshold:
+            regressions.append((key, "time", old["best_s"], row["best_s"], ratio))
+        if old.get("peak_bytes") and row.get("peak_bytes", 0) > old["peak_bytes"] * (1 + memory_threshold):
+            regressions.append((key, "memory", old["peak_bytes"], row["peak_bytes"],
+                                row["peak_bytes"] / old["peak_bytes"]))
+    for key, metric, old, new, ratio in regressions:
+        label = " ".join(str(part) for part in key[1:])
+        print(f"REGRESSION {key[0]} {label}: {metric} {old:.6g} -> {new:.6g} ({ratio:.2f}x)")
+    print(f"Compared {matched} measurements, {len(regressions)} regressions "
+          f"(thresholds: time +{time_threshold:.0%}, memory +{memory_threshold:.0%})")
+    return regressions
+
+def summarize_generators(rows):
+    # Mean realtime factor per generator over every timed duration and note
+    by_name = {}
+    for row in rows:
+        if "best_s" in row:
+            by_name.setdefault(row["name"], []).append(row)
+    for name, measured in by_name.items():
+        samples_per_s = statistics.mean(row["samples_per_s"] for row in measured)
+        realtime = statistics.mean(row["realtime_factor"] for row in measured)
+        print(f"{name:<26}{samples_per_s / 1e6:>9.2f} Msamples/s{realtime:>10.1f}x realtime")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the synthesizer and full renders.")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--input", help="load results from this file instead of running the suite")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=0.10, help="allowed relative memory growth")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="fewer durations and notes")
+    parser.add_argument("--large", action="store_true", help="include the 100-instrument, 1-hour config")
+    parser.add_argument("--skip-generators", action="store_true")
+    parser.add_argument("--skip-renders", action="store_true")
+    parser.add_argument("--skip-loads", action="store_true")
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input, "r") as f:
+            results = json.load(f)
+    else:
+        results = {"version": RESULTS_VERSION, "environment": environment(),
+                   "options": {"repeats": args.repeats, "quick": args.quick, "large": args.large,
+                               "dtype": args.dtype},
+                   "generators": [], "renders": [], "loads": []}
+        if not args.skip_generators:
+            durations = QUICK_DURATIONS if args.quick else DURATIONS
+            notes = QUICK_NOTES if args.quick else NOTES
+            results["generators"] = bench_generators(durations, notes, args.repeats, args.dtype)
+            summarize_generators(results["generators"])
+        if not args.skip_renders:
+            with tempfile.TemporaryDirectory() as workdir:
+                results["renders"] = bench_renders(render_cases(args.large), max(1, args.repeats // 2),
+                                                   args.dtype, workdir)
+        if not args.skip_loads:
+            with tempfile.TemporaryDirectory() as workdir:
+                results["loads"] = bench_loads(args.repeats, workdir)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("version") != RESULTS_VERSION:
+            raise SystemExit(f"Unsupported results version in {args.compare}")
+        if compare(results, baseline, args.threshold, args.memory_threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import argparse
+import json
+import sys
+import time
+
+import gg
+
+# Converts scores between the JSON config schema and the binary score format.
+#
+#   python convert_score.py track.json track.score      # JSON -> binary
+#   python convert_score.py track.score track.json      # binary -> JSON
+#
+# The input format is detected from the file, the output format from the
+# extension (.json writes JSON, anything else a binary score). Conversions are
+# lossless: converting back gives a config equal to the original.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert scores between JSON and the binary score format.")
+    parser.add_argument("input", help="JSON config or binary score")
+    parser.add_argument("output", help="output path; .json writes JSON, anything else a binary score")
+    parser.add_argument("--indent", type=int, default=4, help="JSON indentation")
+    parser.add_argument("--verify", action="store_true", help="reload the output and compare it with the input")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        score = gg.load_score(args.input)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error reading {args.input}: {e}")
+        return 1
+    if args.output.endswith(".json"):
+        with open(args.output, "w") as f:
+            json.dump(score.to_config(), f, indent=args.indent)
+    else:
+        score.save(args.output)
+    print(f"Converted {args.input} -> {args.output}: {len(score.instruments)} instruments, "
+          f"{len(score)} events in {time.perf_counter() - start:.3f}s")
+    if args.verify and gg.load_score(args.output).to_config() != score.to_config():
+        print("Error: the converted score does not match the input")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
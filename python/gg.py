@@ -1,6 +1,20 @@
 import numpy as np
-from scipy.io.wavfile import write
+from scipy.io.wavfile import read as read_wav
+from scipy.linalg import blas
+from scipy.signal import fftconvolve, lfilter, resample_poly
+import contextlib
+import copy
+import hashlib
+import itertools
 import json
+import math
+import os
+import struct
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 NOTE_FREQ = {
     # Octave 0
@@ -31,219 +45,1171 @@ NOTE_FREQ = {
     "REST": 0.0
 }
 
-class RealisticInstrumentSynthesizer:
-    def __init__(self, sample_rate=44100):
-        self.sample_rate = sample_rate
+DEFAULT_NOTE_CACHE_BYTES = 128 * 1024 * 1024
 
-    def generate_violin(self, freq, duration, volume):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            harmonics = [(1.0, freq), (0.5, freq * 2), (0.25, freq * 3), (0.125, freq * 4)]
-            for amp, harmonic_freq in harmonics:
-                wave += amp * np.sin(2 * np.pi * harmonic_freq * t)
-            bow_noise = 0.05 * np.random.normal(0, 1, len(t))
-            vibrato = 0.02 * np.sin(2 * np.pi * 6 * t) * np.sin(2 * np.pi * freq * t)
-            wave += bow_noise + vibrato
-        envelope = self._create_violin_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_violin_envelope(self, duration):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.05, 0.1, 0.7, 0.2
-        attack_samples = int(attack * self.sample_rate)
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples) ** 2
-        decay_samples = int(decay * self.sample_rate)
-        if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** 1.5
-        sustain_start = int((attack + decay) * self.sample_rate)
-        sustain_end = int((duration - release) * self.sample_rate)
-        envelope[sustain_start:sustain_end] = sustain
-        if release_samples := int(release * self.sample_rate):
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** 0.5
+class NoteCache:
+    # LRU cache for the deterministic part of a note (harmonics x envelope).
+    # Values are (tone, noise_envelope) tuples; noise is drawn per event on top.
+    def __init__(self, max_bytes=DEFAULT_NOTE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _nbytes(parts):
+        return sum(part.nbytes for part in parts if part is not None)
+
+    def get(self, key):
+        parts = self._entries.get(key)
+        if parts is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return parts
+
+    def put(self, key, parts):
+        size = self._nbytes(parts)
+        if size > self.max_bytes:
+            return
+        for part in parts:
+            if part is not None:
+                part.setflags(write=False)
+        if key in self._entries:
+            self.bytes_used -= self._nbytes(self._entries.pop(key))
+        self._entries[key] = parts
+        self.bytes_used += size
+        while self.bytes_used > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes_used -= self._nbytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes_used = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+DEFAULT_ENVELOPE_TABLE_BYTES = DEFAULT_NOTE_CACHE_BYTES
+
+class EnvelopeTable:
+    # Read-only ADSR curves per (instrument, sample count, duration, sample_rate,
+    # dtype) plus the shared time axes they and the generators are built on. A
+    # table can be shared by several synthesizers. Both live in one LRU capped
+    # at max_bytes, so a long-lived synthesizer seeing ever new note lengths
+    # stays bounded; arrays larger than the cap are built but not kept.
+    def __init__(self, max_bytes=DEFAULT_ENVELOPE_TABLE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.builds = 0
+        self.allocations_saved = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # ("time", ...) or ("envelope", ...) -> array
+
+    def _get(self, key, build):
+        array = self._entries.get(key)
+        if array is not None:
+            self._entries.move_to_end(key)
+            self.allocations_saved += 1
+            return array
+        array = build()
+        array.setflags(write=False)
+        if array.nbytes <= self.max_bytes:
+            self._entries[key] = array
+            self.bytes_used += array.nbytes
+            while self.bytes_used > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_used -= evicted.nbytes
+                self.evictions += 1
+        return array
+
+    def time_axis(self, duration, sample_rate, dtype=np.float64):
+        samples = int(sample_rate * duration)
+        return self._get(("time", samples, duration, np.dtype(dtype)),
+                         lambda: np.linspace(0, duration, samples, False, dtype=dtype))
+
+    def envelope(self, kind, duration, sample_rate, build, dtype=np.float64):
+        key = ("envelope", kind, int(sample_rate * duration), duration, sample_rate, np.dtype(dtype))
+        def counted():
+            self.builds += 1
+            return build(duration)
+        return self._get(key, counted)
+
+    def nbytes(self):
+        return self.bytes_used
+
+    def reset_counters(self):
+        self.builds = 0
+        self.allocations_saved = 0
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes_used = 0
+
+    def stats(self):
+        envelopes = sum(key[0] == "envelope" for key in self._entries)
+        return {
+            "envelopes": envelopes,
+            "time_axes": len(self._entries) - envelopes,
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "builds": self.builds,
+            "allocations_saved": self.allocations_saved,
+            "evictions": self.evictions,
+        }
+
+DEFAULT_NOISE_BANK_BYTES = 32 * 1024 * 1024
+NOISE_BANK_SEED = 20240611
+
+class NoiseBank:
+    # One seeded buffer of unit Gaussian noise per dtype. Notes read windows
+    # of it at offsets picked by their noise seed instead of drawing fresh
+    # samples; a window is a read-only view, so it costs neither generation
+    # nor a copy. Buffers are built on first use from seed, so every process
+    # and render with the same bank hears the same noise. max_bytes is the
+    # size of each buffer; noise_compare.py checks the statistics.
+    def __init__(self, max_bytes=DEFAULT_NOISE_BANK_BYTES, seed=NOISE_BANK_SEED):
+        self.max_bytes = max_bytes
+        self.seed = seed
+        self.windows = 0
+        self.fallbacks = 0
+        self._buffers = {}
+
+    def buffer(self, dtype=np.float64):
+        dtype = np.dtype(dtype)
+        buffer = self._buffers.get(dtype)
+        if buffer is None:
+            # float32 casts the float64 draws, so both dtypes get the same
+            # windows for the same keys (and float32 uses half of max_bytes)
+            samples = self.max_bytes // 8
+            buffer = np.random.default_rng(self.seed).normal(0, 1, samples).astype(dtype, copy=False)
+            buffer.setflags(write=False)
+            self._buffers[dtype] = buffer
+        return buffer
+
+    def window(self, samples, key, dtype=np.float64):
+        # samples of noise at an offset chosen by the integer key, or None
+        # when the bank is shorter than the request
+        buffer = self.buffer(dtype)
+        span = len(buffer) - samples
+        if span < 0:
+            self.fallbacks += 1
+            return None
+        self.windows += 1
+        start = key % (span + 1)
+        return buffer[start:start + samples]
+
+    def clear(self):
+        self._buffers.clear()
+
+    def stats(self):
+        return {
+            "bytes_used": sum(buffer.nbytes for buffer in self._buffers.values()),
+            "max_bytes": self.max_bytes,
+            "windows": self.windows,
+            "fallbacks": self.fallbacks,
+        }
+
+_NOT_PROFILED = contextlib.nullcontext()
+
+class Profiler:
+    # Opt-in wall-clock timers per render stage and counters per instrument
+    # type. Stage times are inclusive (noise runs inside a note, oscillators
+    # inside envelope builds). With trace=True every timed span is also kept
+    # for a Chrome trace (chrome://tracing, Perfetto).
+    def __init__(self, trace=False):
+        self.stages = {}
+        self.instruments = {}
+        self.spans = [] if trace else None
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            totals = self.stages.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += end - start
+            if self.spans is not None:
+                self.spans.append((name, start, end, args))
+
+    def note(self, instrument_type, wave, seconds):
+        counters = self.instruments.setdefault(instrument_type, {"notes": 0, "samples": 0, "bytes": 0, "times": []})
+        counters["notes"] += 1
+        if wave is not None:
+            counters["samples"] += len(wave)
+            counters["bytes"] += wave.nbytes
+        counters["times"].append(seconds)
+
+    def report(self):
+        stages = {name: {"calls": calls, "seconds": seconds}
+                  for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1])}
+        instruments = {}
+        for instrument_type, counters in sorted(self.instruments.items()):
+            times = np.array(counters["times"])
+            p50, p90, p99 = np.percentile(times, [50, 90, 99]) if len(times) else (0.0, 0.0, 0.0)
+            instruments[instrument_type] = {
+                "notes": counters["notes"],
+                "samples": counters["samples"],
+                "bytes_allocated": counters["bytes"],
+                "seconds": float(times.sum()),
+                "note_ms": {"p50": p50 * 1e3, "p90": p90 * 1e3, "p99": p99 * 1e3,
+                            "max": float(times.max()) * 1e3 if len(times) else 0.0},
+            }
+        return {"stages": stages, "instruments": instruments}
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [{"name": name, "cat": "render", "ph": "X", "pid": pid, "tid": 0,
+                   "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6, "args": args}
+                  for name, start, end, args in self.spans or ()]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def summary(self):
+        lines = []
+        report = self.report()
+        for name, stage in report["stages"].items():
+            lines.append(f"  {name:<16}{stage['seconds']:>9.3f}s{stage['calls']:>9} calls")
+        for instrument_type, counters in report["instruments"].items():
+            note_ms = counters["note_ms"]
+            lines.append(f"  {instrument_type:<16}{counters['notes']:>6} notes  p50 {note_ms['p50']:.2f} ms"
+                         f"  p99 {note_ms['p99']:.2f} ms  {counters['bytes_allocated'] / 1e6:.1f} MB")
+        return "\n".join(lines)
+
+# Built-in instruments as declarative specs (see InstrumentKernel). A spec is
+# plain JSON: configs define more under "instrument_specs", and
+# register_instrument adds them here.
+INSTRUMENT_SPECS = {
+    "violin": {
+        "partials": [[1.0, 1], [0.5, 2], [0.25, 3], [0.125, 4]],
+        "vibrato": {"rate": 6, "depth": 0.02},
+        "envelope": {"type": "adsr", "attack": 0.05, "decay": 0.1, "sustain": 0.7, "release": 0.2,
+                     "curves": [2, 1.5, 0.5]},
+        "noise": {"level": 0.05},  # bow noise
+    },
+    "cello": {
+        "partials": [[1.0, 1], [0.4, 2], [0.2, 3], [0.1, 4], [0.1, 0.5]],  # + body resonance
+        "envelope": {"type": "adsr", "attack": 0.1, "decay": 0.15, "sustain": 0.8, "release": 0.3,
+                     "curves": [1.5, 1.3, 0.7]},
+        "noise": {"level": 0.03},  # string noise
+    },
+    "acoustic_guitar": {
+        "partials": [[1.0, 1], [0.3, 2], [0.15, 3], [0.07, 4], [0.05, 0.25]],  # + wood resonance
+        "envelope": {"type": "pluck", "attack": 0.01, "decay": 0.2, "sustain": 0.5, "ring": 5, "curves": [1, 2]},
+        "noise": {"level": 0.1, "decay": 10},  # pluck noise
+    },
+    "bass": {
+        "partials": [[1.0, 1], [0.6, 2], [0.3, 3], [0.1, 4], [0.15, 0.5]],  # + body resonance
+        "envelope": {"type": "adsr", "attack": 0.03, "decay": 0.1, "sustain": 0.85, "release": 0.15,
+                     "curves": [1.5, 1.2, 0.8]},
+        "noise": {"level": 0.02},  # string noise
+    },
+    "electric_guitar": {
+        "partials": [[1.0, 1], [0.8, 2], [0.6, 3], [0.4, 4], [0.2, 5]],  # sawtooth-like
+        "shaper": {"type": "tanh", "drive": 2},  # soft clipping for distortion
+        "envelope": {"type": "adsr", "attack": 0.01, "decay": 0.15, "sustain": 0.7, "release": 0.2,
+                     "curves": [1, 1.5, 0.8]},
+        "noise": {"level": 0.05},
+    },
+    "synth_pad": {
+        "partials": [[1.0, 1], [0.8, 1.01, 1], [0.6, 0.99, -1], [0.3, 2]],  # detuned voices (spread apart) + octave
+        "envelope": {"type": "adsr", "attack": 0.2, "decay": 0.3, "sustain": 0.6, "release": 0.4,
+                     "curves": [1.5, 1, 0.5]},
+    },
+    "piano": {
+        # Same tone as generate_wave
+        "envelope": {"type": "exponential", "rate": 2},
+    },
+    "drum_kick": {
+        # Low-frequency thump with quick decay and a noise burst
+        "pitched": False,
+        "partials": [[1.0, 60]],
+        "decay": 15,
+        "envelope": {"type": "exponential", "rate": 15},
+        "noise": {"level": 0.5, "decay": 20},
+    },
+    "drum_snare": {
+        # Sharp noise with tonal component
+        "pitched": False,
+        "partials": [[1.0, 200]],
+        "decay": 10,
+        "envelope": {"type": "exponential", "rate": 15},
+        "noise": {"level": 1.0, "decay": 12},
+    },
+    "drum_hihat": {
+        # Bright noise with a few inharmonic metallic partials, very short decay
+        "pitched": False,
+        "partials": [[1.0, 3140], [1.0, 4350], [1.0, 5870], [1.0, 7920]],
+        "gain": 0.1,
+        "decay": 40,
+        "envelope": {"type": "exponential", "rate": 15},
+        "noise": {"level": 0.6, "decay": 40},
+    },
+}
+
+WAVETABLE_SIZE = 4096
+WAVETABLE_MAX_HARMONIC = 32  # partials further apart than this get their own table
+
+def _group_partials(partials):
+    # Split partials into harmonic series: each group is (base ratio, [(amp, harmonic)])
+    groups = []
+    for amp, ratio in sorted(partials, key=lambda p: p[1]):
+        for base, members in groups:
+            harmonic = ratio / base
+            if abs(harmonic - round(harmonic)) < 1e-9 and round(harmonic) <= WAVETABLE_MAX_HARMONIC:
+                members.append((amp, int(round(harmonic))))
+                break
+        else:
+            groups.append((ratio, [(amp, 1)]))
+    return groups
+
+class Wavetable:
+    # One period of a harmonic series, band-limited per harmonic count and read
+    # through a 64-bit phase accumulator with linear or cubic interpolation.
+    def __init__(self, harmonics, shaper=None, size=WAVETABLE_SIZE):
+        self.harmonics = harmonics
+        self.shaper = shaper
+        self.size = size
+        self.bits = size.bit_length() - 1
+        self.max_harmonic = size // 8 if shaper is not None else max(h for _, h in harmonics)
+        self._levels = {}
+
+    def _level(self, limit, dtype=np.float64):
+        limit = min(limit, self.max_harmonic)
+        table = self._levels.get((limit, np.dtype(dtype)))
+        if table is None:
+            if self.shaper is None:
+                x = np.arange(self.size) / self.size
+                period = np.zeros(self.size)
+                for amp, harmonic in self.harmonics:
+                    if harmonic <= limit:
+                        period += amp * np.sin(2 * np.pi * harmonic * x)
+            else:
+                # Shape an oversampled period, then keep only the harmonics below the limit
+                oversampled = 8 * self.size
+                x = np.arange(oversampled) / oversampled
+                stack = np.zeros(oversampled)
+                for amp, harmonic in self.harmonics:
+                    stack += amp * np.sin(2 * np.pi * harmonic * x)
+                spectrum = np.fft.rfft(self.shaper(stack)) / oversampled
+                spectrum[limit + 1:] = 0
+                period = np.fft.irfft(spectrum[:self.size // 2 + 1], n=self.size) * self.size
+            # One guard sample before and two after for cubic interpolation
+            table = np.concatenate([period[-1:], period, period[:2]]).astype(dtype, copy=False)
+            table.setflags(write=False)
+            self._levels[(limit, np.dtype(dtype))] = table
+        return table
+
+    def render(self, freq, step, samples, interpolation="linear", dtype=np.float64, band_limit=0.5):
+        # freq is a scalar or a column of frequencies; step is seconds per
+        # sample; harmonics at or above band_limit cycles per sample are left out
+        cycles = np.asarray(freq, dtype=np.float64) * step
+        shape = np.broadcast_shapes(cycles.shape, (samples,))
+        cycles = cycles.reshape(-1, 1)
+        increment = (np.round(np.mod(cycles, 1.0) * 2.0 ** 52) * 2 ** 12).astype(np.uint64)
+        phase = np.arange(samples, dtype=np.uint64) * increment
+        limits = np.floor(band_limit / np.maximum(cycles[:, 0], 1e-12)).astype(np.int64)
+        distinct = np.unique(limits)
+        if len(distinct) == 1 and distinct[0] >= 1:
+            return self._lookup(self._level(int(distinct[0]), dtype), phase, interpolation).reshape(shape)
+        out = np.zeros(phase.shape, dtype)
+        for limit in distinct:
+            if limit >= 1:  # rows whose fundamental is above Nyquist stay silent
+                rows = limits == limit
+                out[rows] = self._lookup(self._level(int(limit), dtype), phase[rows], interpolation)
+        return out.reshape(shape)
+
+    def _lookup(self, table, phase, interpolation):
+        shift = np.uint64(64 - self.bits)
+        index = (phase >> shift).astype(np.intp)
+        frac = (phase & np.uint64((1 << (64 - self.bits)) - 1)).astype(table.dtype)
+        frac *= table.dtype.type(1.0 / (1 << (64 - self.bits)))
+        return _interpolate(table, index, frac, interpolation)
+
+def _interpolate(table, index, frac, interpolation):
+    # Samples frac of the way from table[index + 1] to table[index + 2]; the
+    # table has one guard sample before and two after for cubic interpolation
+    y1 = table[1:].take(index)
+    y2 = table[2:].take(index)
+    if interpolation == "cubic":
+        # Catmull-Rom through the four neighbouring samples
+        y0 = table.take(index)
+        y3 = table[3:].take(index)
+        c1 = 0.5 * (y2 - y0)
+        c2 = y0 - 2.5 * y1 + 2 * y2 - 0.5 * y3
+        c3 = 0.5 * (y3 - y0) + 1.5 * (y1 - y2)
+        return ((c3 * frac + c2) * frac + c1) * frac + y1
+    y2 -= y1
+    y2 *= frac
+    y2 += y1
+    return y2
+
+SAMPLER_ENVELOPE = {"type": "adsr", "attack": 0.005, "release": 0.02}  # "sampler" instruments without an envelope
+SAMPLE_POSITION_BYTES = 32 * 1024 * 1024  # read positions a SampleSet keeps per pitch step
+
+def _sample_files(samples, where):
+    # [(root frequency, path)] of a spec's "samples": an object of WAV paths
+    # by note name, or a directory of <note>.wav files
+    if isinstance(samples, str):
+        try:
+            names = sorted(name for name in os.listdir(samples) if name.lower().endswith(".wav"))
+        except OSError as e:
+            raise ValueError(f"{where}: cannot list samples: {e}")
+        samples = {os.path.splitext(name)[0]: os.path.join(samples, name) for name in names}
+    if not isinstance(samples, dict) or not samples:
+        raise ValueError(f"{where}: samples must be a directory or an object of WAV paths by note")
+    files = []
+    for note, path in samples.items():
+        if NOTE_FREQ.get(note, 0) <= 0 or not isinstance(path, str):
+            raise ValueError(f"{where}: samples must be WAV paths by note name, not '{note}'")
+        files.append((NOTE_FREQ[note], path))
+    return sorted(files)
+
+def _sample_signature(spec):
+    # Size and modification time of a spec's sample files, so an edited
+    # library is never served from caches of the old one; None without samples
+    if not isinstance(spec, dict) or "samples" not in spec:
+        return None
+    try:
+        files = _sample_files(spec["samples"], "samples")
+    except ValueError:
+        return None  # compiling the spec reports it
+    signature = []
+    for _, path in files:
+        try:
+            stat = os.stat(path)
+            signature.append([path, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            signature.append([path, None, None])
+    return signature
+
+def _sample_paths(spec, base_dir):
+    # spec with its sample paths taken relative to base_dir
+    if not isinstance(spec, dict) or "samples" not in spec:
+        return spec
+    samples = spec["samples"]
+    if isinstance(samples, str):
+        samples = os.path.join(base_dir, samples)
+    elif isinstance(samples, dict):
+        samples = {note: os.path.join(base_dir, path) if isinstance(path, str) else path
+                   for note, path in samples.items()}
+    return dict(spec, samples=samples)
+
+def uses_samples(config):
+    # Whether a config plays recorded samples, which name files on disk
+    specs = config.get("instrument_specs")
+    specs = list(specs.values()) if isinstance(specs, dict) else []
+    for instrument in config.get("instruments", []):
+        if instrument.get("type") == "sampler":
+            return True
+        specs.append(instrument.get("spec"))
+    return any(isinstance(spec, dict) and "samples" in spec for spec in specs)
+
+class SampleSet:
+    # Recorded one-shots by root frequency. The WAVs are memory-mapped, so
+    # opening a library reads only their headers and a note pages in only the
+    # frames it plays. 8-, 16- and 32-bit integer and float files are read;
+    # channels are mixed to mono.
+    def __init__(self, files, where="samples"):
+        self.roots = []
+        self.recordings = []  # (sample rate, memory-mapped frames)
+        for root, path in files:
+            try:
+                rate, data = read_wav(path, mmap=True)
+            except (OSError, ValueError) as e:
+                raise ValueError(f"{where}: cannot read {path}: {e}")
+            if data.dtype.kind not in "iuf" or not len(data):
+                raise ValueError(f"{where}: {path} holds no samples")
+            self.roots.append(root)
+            self.recordings.append((rate, data))
+        self._log_roots = np.log2(self.roots)
+        # step -> (frame index, fraction) of each output sample. Every note a
+        # semitone above its root reads at the same step, so a library only
+        # ever needs a few of these.
+        self._positions = {}
+        self._position_bytes = 0
+
+    def _pick(self, freq, sample_rate):
+        # The recording nearest to freq in pitch and its step in frames per
+        # output sample; None plays the lowest root as recorded
+        index = 0 if freq is None else int(np.argmin(np.abs(self._log_roots - np.log2(freq))))
+        rate, data = self.recordings[index]
+        step = rate / sample_rate
+        if freq is not None:
+            step *= freq / self.roots[index]
+        return data, step
+
+    def length(self, freq, sample_rate):
+        # Output samples until the pitched recording ends
+        data, step = self._pick(freq, sample_rate)
+        return int(math.ceil(len(data) / step))
+
+    def render(self, freq, samples, sample_rate, interpolation="linear", dtype=np.float64):
+        # The first `samples` samples of the recording pitched to freq, read at
+        # fractional positions; shorter when the recording ends first
+        data, step = self._pick(freq, sample_rate)
+        samples = min(samples, int(math.ceil(len(data) / step)))
+        if samples <= 0:
+            return np.zeros(0, dtype)
+        index, frac = self._read_positions(step, samples, dtype)
+        count = min(len(data), int(index[-1]) + 3)
+        # The frames read, scaled to [-1, 1], between the interpolation guards
+        table = np.zeros(count + 3, dtype)
+        frames = data[:count] if data.ndim == 1 else data[:count].mean(axis=1)
+        if data.dtype.kind == "u":
+            frames = frames - 128.0
+        scale = 1.0 if data.dtype.kind == "f" else 2.0 ** (1 - 8 * data.dtype.itemsize)
+        np.multiply(frames, scale, out=table[1:count + 1], casting="unsafe")
+        return _interpolate(table, index, frac, interpolation)
+
+    def _read_positions(self, step, samples, dtype):
+        positions = self._positions.get((step, dtype))
+        if positions is None or len(positions[0]) < samples:
+            read = np.arange(samples, dtype=np.float64)
+            read *= step
+            index = read.astype(np.intp)
+            read -= index
+            positions = (index, read.astype(dtype, copy=False))
+            old = self._positions.pop((step, dtype), None)
+            if old is not None:
+                self._position_bytes -= old[0].nbytes + old[1].nbytes
+            size = positions[0].nbytes + positions[1].nbytes
+            if self._position_bytes + size > SAMPLE_POSITION_BYTES:
+                self._positions.clear()
+                self._position_bytes = 0
+            if size <= SAMPLE_POSITION_BYTES:
+                self._positions[(step, dtype)] = positions
+                self._position_bytes += size
+        return positions[0][:samples], positions[1][:samples]
+
+MAX_SPEC_PARTIALS = 64
+MAX_INSTRUMENT_KERNELS = 256  # compiled specs kept; a server sees new ones with every job
+ENVELOPE_FIELDS = {
+    "adsr": {"attack": 0.0, "decay": 0.0, "sustain": 1.0, "release": 0.0, "curves": [1, 1, 1]},
+    "pluck": {"attack": 0.0, "decay": 0.0, "sustain": 1.0, "ring": 0.0, "curves": [1, 1]},
+    "exponential": {"rate": 0.0},
+}
+WAVESHAPERS = {
+    "tanh": lambda drive: lambda w: np.tanh(w * drive),
+    "clip": lambda drive: lambda w: np.clip(w * drive, -1, 1),
+}
+
+def _spec_number(value, where, minimum=0.0):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not minimum <= value < math.inf:
+        raise ValueError(f"{where} must be a finite number" + (f" >= {minimum:g}" if minimum > -math.inf else ""))
+    return float(value)
+
+def _spec_section(spec, fields, where):
+    # spec's values for fields (name -> default), refusing keys it does not know
+    if not isinstance(spec, dict):
+        raise ValueError(f"{where} must be an object")
+    unknown = sorted(set(spec) - set(fields))
+    if unknown:
+        raise ValueError(f"{where} has unknown keys {unknown}")
+    return {name: spec.get(name, default) for name, default in fields.items()}
+
+class InstrumentKernel:
+    # An instrument spec compiled once into a partial table, wavetables, a
+    # waveshaper and an envelope builder; parts() is the one synthesis path of
+    # every instrument. Spec keys (all but "envelope" optional):
+    #   partials  [[amp, ratio], ...] of the note frequency, or of 1 Hz when
+    #             "pitched" is false (default one partial at the fundamental).
+    #             An optional third value in [-1, 1] spreads the partial
+    #             towards the first or last output channel by the playing
+    #             instrument's "width" (see side())
+    #   shaper    {"type": "tanh" or "clip", "drive": d} on the partial sum
+    #   vibrato   {"rate": Hz, "depth": d}: the fundamental at depth, amplitude-
+    #             modulated at rate, added to the tone
+    #   gain, decay  the tone times gain * exp(-decay * t)
+    #   envelope  {"type": "adsr", "attack", "decay", "sustain", "release",
+    #             "curves": [attack, decay, release exponents]}, {"type":
+    #             "pluck", "attack", "decay", "sustain", "ring", "curves":
+    #             [attack, decay]} which rings from full level as exp(-ring * t)
+    #             after the decay, or {"type": "exponential", "rate": r}
+    #   noise     {"level": l, "decay": d}: Gaussian noise at l * exp(-d * t),
+    #             times the envelope
+    #   samples   recordings played instead of partials, shaper and vibrato:
+    #             {note name: WAV path} or a directory of <note name>.wav
+    #             files. Each note plays the nearest root pitched by
+    #             resampling, or the lowest root as recorded when "pitched" is
+    #             false (see SampleSet)
+    def __init__(self, spec, name, digest):
+        where = f"instrument '{name}'"
+        fields = _spec_section(spec, {"pitched": True, "partials": [[1.0, 1]], "shaper": None, "vibrato": None,
+                                      "gain": 1.0, "decay": 0.0, "envelope": None, "noise": None,
+                                      "samples": None}, where)
+        self.name = name
+        self.kind = f"{name}:{digest}"  # note cache kind: a changed spec never hits old notes
+        if not isinstance(fields["pitched"], bool):
+            raise ValueError(f"{where}: pitched must be true or false")
+        self.pitched = fields["pitched"]
+        self.samples = None
+        if fields["samples"] is not None:
+            if "partials" in spec or fields["shaper"] is not None or fields["vibrato"] is not None:
+                raise ValueError(f"{where}: samples replace partials, shaper and vibrato")
+            self.samples = SampleSet(_sample_files(fields["samples"], where), where)
+
+        partials = fields["partials"]
+        if not isinstance(partials, list) or not 0 < len(partials) <= MAX_SPEC_PARTIALS:
+            raise ValueError(f"{where}: partials must be a list of 1 to {MAX_SPEC_PARTIALS} [amp, ratio] pairs")
+        self.partials = []
+        self.spread = []  # (amp * spread, ratio) of the spread partials
+        for partial in partials:
+            if not isinstance(partial, list) or len(partial) not in (2, 3):
+                raise ValueError(f"{where}: partials must be [amp, ratio] pairs or [amp, ratio, spread]")
+            amp = _spec_number(partial[0], f"{where}: a partial amplitude", -math.inf)
+            self.partials.append((amp, _spec_number(partial[1], f"{where}: a partial ratio", 1e-9)))
+            if len(partial) == 3:
+                spread = _spec_number(partial[2], f"{where}: a partial spread", -1.0)
+                if spread > 1:
+                    raise ValueError(f"{where}: a partial spread must be in [-1, 1]")
+                if spread:
+                    self.spread.append((amp * spread, self.partials[-1][1]))
+        # A lone sine is cheaper through np.sin than through a table lookup, and
+        # unpitched partials are inharmonic, so both are summed as sines
+        self.sines = not self.pitched or len(self.partials) == 1
+
+        self.shaper = None
+        if fields["shaper"] is not None:
+            shaper = _spec_section(fields["shaper"], {"type": None, "drive": 1.0}, f"{where}: shaper")
+            if shaper["type"] not in WAVESHAPERS:
+                raise ValueError(f"{where}: shaper type must be one of {sorted(WAVESHAPERS)}")
+            self.shaper = WAVESHAPERS[shaper["type"]](_spec_number(shaper["drive"], f"{where}: shaper drive"))
+            if self.spread:
+                raise ValueError(f"{where}: spread partials cannot be waveshaped")
+        self.wavetables = None
+        if not self.sines:
+            groups = _group_partials(self.partials)
+            # A waveshaper can only be baked into the table when the stack is one series
+            self.wavetables = [(base, Wavetable(harmonics, self.shaper if len(groups) == 1 else None))
+                               for base, harmonics in groups]
+
+        self.vibrato = None
+        if fields["vibrato"] is not None:
+            vibrato = _spec_section(fields["vibrato"], {"rate": 0.0, "depth": 0.0}, f"{where}: vibrato")
+            self.vibrato = (_spec_number(vibrato["rate"], f"{where}: vibrato rate"),
+                            _spec_number(vibrato["depth"], f"{where}: vibrato depth"))
+        self.gain = _spec_number(fields["gain"], f"{where}: gain")
+        self.decay = _spec_number(fields["decay"], f"{where}: decay")
+
+        envelope = fields["envelope"]
+        if not isinstance(envelope, dict) or envelope.get("type") not in ENVELOPE_FIELDS:
+            raise ValueError(f"{where}: envelope must have a type in {sorted(ENVELOPE_FIELDS)}")
+        kind = envelope["type"]
+        envelope = _spec_section({key: value for key, value in envelope.items() if key != "type"},
+                                 ENVELOPE_FIELDS[kind], f"{where}: {kind} envelope")
+        curves = envelope.pop("curves", None)
+        values = [_spec_number(value, f"{where}: envelope {key}") for key, value in envelope.items()]
+        if curves is not None:
+            if not isinstance(curves, list) or len(curves) != len(ENVELOPE_FIELDS[kind]["curves"]):
+                raise ValueError(f"{where}: {kind} curves must be {len(ENVELOPE_FIELDS[kind]['curves'])} exponents")
+            values.append(tuple(_spec_number(curve, f"{where}: an envelope curve", 1e-9) for curve in curves))
+        # Instruments with equal envelopes share one EnvelopeTable entry
+        self.envelope_key = (kind, *values)
+
+        self.noise = None
+        if fields["noise"] is not None:
+            noise = _spec_section(fields["noise"], {"level": 0.0, "decay": 0.0}, f"{where}: noise")
+            self.noise = (_spec_number(noise["level"], f"{where}: noise level"),
+                          _spec_number(noise["decay"], f"{where}: noise decay"))
+
+    def parts(self, synth, freq, duration):
+        # (tone, noise envelope) of one note at unit volume; freq is a scalar,
+        # a column of frequencies or, for unpitched instruments, ignored
+        if self.samples is not None:
+            wave = self._sampled(synth, freq if self.pitched else None, duration)
+        else:
+            wave = self._tone(synth, 1.0 if not self.pitched else freq, duration)
+        if self.vibrato is not None:
+            rate, depth = self.vibrato
+            lfo = synth.envelope(("vibrato", rate, depth), duration, lambda d: depth * synth._sine(rate, d))
+            wave += lfo * synth._sine(freq if self.pitched else 1.0, duration)
+        t = synth.time_axis(duration)
+        envelope = self._amplitude(synth, wave, t, duration)
+        if self.noise is None:
+            return wave, None
+        level, decay = self.noise
+        if decay:
+            return wave, level * np.exp(-decay * t) * envelope
+        return wave, level * envelope
+
+    def side(self, synth, freq, duration):
+        # (side, None) of one note at unit volume: the spread partials times
+        # their spread, shaped like the tone. Channel c of a stereo (or wider)
+        # mix gets the tone plus width * (2c / (channels - 1) - 1) times this,
+        # so the channels still sum to the tone.
+        if not self.pitched:
+            freq = 1.0
+        samples = int(synth.sample_rate * duration)
+        wave = np.zeros(np.broadcast_shapes(np.shape(freq), (samples,)), synth.dtype)
+        with synth._stage("oscillator"):
+            for amp, ratio in self.spread:
+                audible = np.asarray(freq) * ratio < synth.band_limit
+                if audible.any():
+                    wave += (amp * audible).astype(synth.dtype) * np.sin(synth._phase(freq * ratio, duration))
+        self._amplitude(synth, wave, synth.time_axis(duration), duration)
+        return wave, None
+
+    def _amplitude(self, synth, wave, t, duration):
+        # Applies gain, decay and the envelope to wave in place; returns the envelope
+        if self.decay:
+            wave *= self.gain * np.exp(-self.decay * t)
+        elif self.gain != 1:
+            wave *= self.gain
+        envelope = synth.envelope(self.envelope_key, duration, lambda d: self._envelope(synth, d))
+        wave *= envelope
         return envelope
 
-    def generate_cello(self, freq, duration, volume):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            harmonics = [(1.0, freq), (0.4, freq * 2), (0.2, freq * 3), (0.1, freq * 4)]
-            for amp, harmonic_freq in harmonics:
-                wave += amp * np.sin(2 * np.pi * harmonic_freq * t)
-            body_resonance = 0.1 * np.sin(2 * np.pi * (freq/2) * t)
-            string_noise = 0.03 * np.random.normal(0, 1, len(t))
-            wave += body_resonance + string_noise
-        envelope = self._create_cello_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_cello_envelope(self, duration):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
+    def _sampled(self, synth, freq, duration):
+        # The recording pitched to freq, silent past its end. The pitched
+        # recording is kept in the note cache under the note's own entries and
+        # grown when a longer note needs more of it, so notes of one pitch but
+        # different lengths resample it once.
+        if np.ndim(freq):
+            return np.stack([self._sampled(synth, f, duration) for f in np.ravel(freq).tolist()])
+        samples = int(synth.sample_rate * duration)
+        with synth._stage("oscillator"):
+            needed = min(samples, self.samples.length(freq, synth.sample_rate))
+            key = synth._cache_key(self.kind + ":pitched", freq, None, None)
+            pitched = synth.note_cache.get(key) if synth.note_cache is not None else None
+            if pitched is None or len(pitched[0]) < needed:
+                pitched = (self.samples.render(freq, needed, synth.sample_rate, synth.interpolation, synth.dtype),
+                           None)
+                if synth.note_cache is None and needed == samples:
+                    return pitched[0]  # nobody else holds it
+                if synth.note_cache is not None:
+                    synth.note_cache.put(key, pitched)
+            wave = np.zeros(samples, synth.dtype)
+            wave[:needed] = pitched[0][:needed]
+        return wave
+
+    def _tone(self, synth, freq, duration):
+        # The (optionally waveshaped) sum of the partials at freq
+        if self.sines:
+            wave = None
+            for amp, ratio in self.partials:
+                part = synth._sine(freq * ratio, duration)
+                if amp != 1:
+                    part *= amp
+                if wave is None:
+                    wave = part
+                else:
+                    wave += part
+            return self.shaper(wave) if self.shaper is not None else wave
+        with synth._stage("oscillator"):
+            samples = int(synth.sample_rate * duration)
+            if synth.oscillator == "sine" or samples < 2:
+                wave = np.zeros(np.broadcast_shapes(np.shape(freq), (samples,)), synth.dtype)
+                for amp, ratio in self.partials:
+                    # Partials past the band limit only cost time and alias
+                    audible = np.asarray(freq) * ratio < synth.band_limit
+                    if audible.all():
+                        wave += amp * np.sin(synth._phase(freq * ratio, duration))
+                    elif audible.any():
+                        wave += (amp * audible).astype(synth.dtype) * np.sin(synth._phase(freq * ratio, duration))
+                return self.shaper(wave) if self.shaper is not None else wave
+            step = duration / samples
+            wave = None
+            for base, table in self.wavetables:
+                part = table.render(freq * base, step, samples, synth.interpolation, synth.dtype,
+                                    synth.band_limit / synth.sample_rate)
+                wave = part if wave is None else wave + part
+            if self.shaper is not None and len(self.wavetables) > 1:
+                wave = self.shaper(wave)
+            return wave
+
+    def _envelope(self, synth, duration):
+        kind, *values = self.envelope_key
+        sample_rate = synth.sample_rate
+        t = synth.time_axis(duration)
+        if kind == "exponential":
+            return np.exp(-values[0] * t)
         envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.1, 0.15, 0.8, 0.3
-        attack_samples = int(attack * self.sample_rate)
+        attack, decay, sustain = values[:3]
+        curves = values[-1]
+        attack_samples = int(attack * sample_rate)
         if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples) ** 1.5
-        decay_samples = int(decay * self.sample_rate)
+            envelope[:attack_samples] = np.linspace(0, 1, attack_samples) ** curves[0]
+        decay_samples = int(decay * sample_rate)
         if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** 1.3
-        sustain_start = int((attack + decay) * self.sample_rate)
-        sustain_end = int((duration - release) * self.sample_rate)
+            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** curves[1]
+        sustain_start = int((attack + decay) * sample_rate)
+        if kind == "pluck":
+            envelope[sustain_start:] *= np.exp(-values[3] * t[sustain_start:])
+            return envelope
+        release = values[3]
+        sustain_end = int((duration - release) * sample_rate)
         envelope[sustain_start:sustain_end] = sustain
-        if release_samples := int(release * self.sample_rate):
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** 0.7
+        if release_samples := int(release * sample_rate):
+            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** curves[2]
         return envelope
 
-    def generate_acoustic_guitar(self, freq, duration, volume):
+_KERNELS = {}
+
+def instrument_kernel(spec, name="custom"):
+    # The compiled kernel of a spec, built once per distinct name and spec and
+    # shared by every synthesizer. Raises ValueError for an invalid spec.
+    text = json.dumps(spec, sort_keys=True)
+    signature = _sample_signature(spec)
+    if signature is not None:
+        text += json.dumps(signature)  # re-recorded samples compile a new kernel
+    kernel = _KERNELS.get((name, text))
+    if kernel is None:
+        if len(_KERNELS) >= MAX_INSTRUMENT_KERNELS:
+            _KERNELS.clear()
+        kernel = InstrumentKernel(spec, name, hashlib.sha256(text.encode()).hexdigest()[:16])
+        _KERNELS[(name, text)] = kernel
+    return kernel
+
+def register_instrument(name, spec):
+    # Makes spec available as instrument type `name` in every config. Specs
+    # are read-only once used: synthesizers keep voices by spec object.
+    if name == "drum":
+        raise ValueError("'drum' is the drum kit; register drum_<sound> instead")
+    instrument_kernel(spec, name)
+    INSTRUMENT_SPECS[name] = spec
+
+def load_instrument_specs(path):
+    # A JSON file of {name: spec}, each checked by compiling it. Sample paths
+    # are taken relative to the file.
+    with open(path) as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        base_dir = os.path.dirname(os.path.abspath(path))
+        specs = {name: _sample_paths(spec, base_dir) for name, spec in specs.items()}
+    return _checked_specs(specs)
+
+def _checked_specs(specs):
+    if not isinstance(specs, dict):
+        raise ValueError("instrument_specs must be an object of specs by name")
+    for name, spec in specs.items():
+        if name == "drum":
+            raise ValueError("'drum' is the drum kit; define drum_<sound> instead")
+        instrument_kernel(spec, name)
+    return specs
+
+def _resolve_specs(instruments, settings):
+    # The instruments with the spec each plays attached as "spec": its own, or
+    # the config's "instrument_specs" entry for its type. Registered types
+    # without one are left as they are. A "sampler" plays its "samples"
+    # under its "envelope" (SAMPLER_ENVELOPE by default).
+    specs = _checked_specs(settings.get("instrument_specs") or {})
+    resolved = []
+    for instrument in instruments:
+        if instrument["type"] == "drum" and "spec" in instrument:
+            raise ValueError("the drum kit takes no spec; define drum_<sound> instruments instead")
+        if instrument["type"] == "sampler" and "spec" not in instrument:
+            if "samples" not in instrument:
+                raise ValueError("a sampler instrument needs \"samples\"")
+            spec = {"samples": instrument["samples"], "envelope": instrument.get("envelope", SAMPLER_ENVELOPE)}
+        else:
+            spec = instrument.get("spec", specs.get(instrument["type"]))
+        if spec is not None:
+            instrument_kernel(spec, instrument["type"])
+            instrument = dict(instrument, spec=spec)
+        resolved.append(instrument)
+    return resolved
+
+MAX_CHORD_VOICES = 8  # default limit on the notes of one chord event ("max_voices" per instrument)
+CHORD_BROADCAST_SAMPLES = 1 << 16  # larger chords are built voice by voice to stay in cache
+DEFAULT_DRUM_TAKES = 4  # round-robin takes per drum sound and length with percussion="trains"
+
+# Per quality level: the render rate as a multiple of the output rate, and the
+# highest partial synthesized as a fraction of the render rate. Draft keeps
+# its partials below the resampling filter's transition band; high renders at
+# twice the rate (less aliasing from waveshaping) but keeps partials below the
+# output Nyquist. Every level drops partials above its render Nyquist.
+QUALITY_LEVELS = {"draft": (0.25, 0.44), "normal": (1, 0.5), "high": (2, 0.25)}
+DRAFT_NOISE_BANK_BYTES = 4 * 1024 * 1024  # draft reads its noise from a bank this size
+
+def render_rate(sample_rate, quality="normal"):
+    # The rate a quality level synthesizes at for a given output rate. Draft
+    # divides by at most 4, keeping the resampling ratio small.
+    factor = QUALITY_LEVELS[quality][0]
+    if factor >= 1:
+        return sample_rate * factor
+    divisor = round(1 / factor)
+    while sample_rate % divisor:
+        divisor //= 2
+    return sample_rate // divisor
+
+class RealisticInstrumentSynthesizer:
+    def __init__(self, sample_rate=44100, note_cache=None, envelopes=None,
+                 oscillator="sine", interpolation="linear", rng=None, dtype=np.float64, profiler=None,
+                 percussion="notes", drum_takes=DEFAULT_DRUM_TAKES, noise_bank=None, quality="normal"):
+        if oscillator not in ("sine", "wavetable"):
+            raise ValueError(f"Unknown oscillator '{oscillator}'")
+        if interpolation not in ("linear", "cubic"):
+            raise ValueError(f"Unknown interpolation '{interpolation}'")
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError(f"Unsupported dtype '{dtype}'")
+        if percussion not in ("notes", "trains"):
+            raise ValueError(f"Unknown percussion mode '{percussion}'")
+        if quality not in QUALITY_LEVELS:
+            raise ValueError(f"Unknown quality '{quality}'")
+        self.sample_rate = sample_rate
+        self.note_cache = note_cache
+        self.envelopes = envelopes if envelopes is not None else EnvelopeTable()
+        self.oscillator = oscillator
+        self.interpolation = interpolation
+        # Time axes, envelopes, notes, noise and the mix bus all use this dtype
+        self.dtype = np.dtype(dtype)
+        # np.random (global legacy state) or an np.random.Generator
+        self.rng = rng if rng is not None else np.random
+        self.profiler = profiler
+        # "trains" mixes unpitched hits as trigger trains of a few cached takes
+        self.percussion = percussion
+        self.drum_takes = max(1, drum_takes)
+        # A NoiseBank replaces per-note Gaussian draws with windows into one buffer
+        if noise_bank is None and quality == "draft":
+            noise_bank = NoiseBank(DRAFT_NOISE_BANK_BYTES)
+        self.noise_bank = noise_bank
+        # sample_rate is the render rate (see render_rate); partials at or
+        # above band_limit Hz are skipped
+        self.quality = quality
+        self.band_limit = QUALITY_LEVELS[quality][1] * sample_rate
+        self._voices = {}
+
+    def _stage(self, name):
+        return self.profiler.stage(name) if self.profiler is not None else _NOT_PROFILED
+
+    def _phase(self, freq, duration):
+        # 2*pi*freq*t for a scalar or column freq. In float32, freq * t loses the
+        # phase over long notes, so the phase is wrapped in a 64-bit accumulator
+        # and only the wrapped value is converted.
+        t = self.time_axis(duration)
+        if self.dtype == np.float64:
+            return 2 * np.pi * freq * t
+        cycles = np.asarray(freq, dtype=np.float64) * (duration / max(len(t), 1))
+        increment = (np.round(np.mod(cycles, 1.0) * 2.0 ** 52) * 2 ** 12).astype(np.uint64)
+        phase = np.arange(len(t), dtype=np.uint64) * increment
+        angle = phase.view(np.int64).astype(self.dtype)  # signed view: [-pi, pi)
+        angle *= self.dtype.type(2 * np.pi / 2.0 ** 64)
+        return angle
+
+    def _sine(self, freq, duration):
+        # A lone sine is cheaper through np.sin than through a table lookup
+        with self._stage("oscillator"):
+            wave = np.sin(self._phase(freq, duration))
+            audible = np.asarray(freq) < self.band_limit
+            if not audible.all():
+                wave *= audible
+            return wave
+
+    def time_axis(self, duration):
+        return self.envelopes.time_axis(duration, self.sample_rate, self.dtype)
+
+    def envelope(self, kind, duration, build):
+        with self._stage("envelope"):
+            return self.envelopes.envelope(kind, duration, self.sample_rate, build, self.dtype)
+
+    def voice(self, instrument_type, sound=None, spec=None):
+        # (cache kind, parts builder, whether the note frequency matters) for
+        # the given spec or a registered instrument type, None for an unknown
+        # type. A "drum" kit picks its sound per event.
+        voices = self._kernel_voices(instrument_type, sound, spec)
+        return voices[0] if voices is not None else None
+
+    def side_voice(self, instrument_type, sound=None, spec=None):
+        # (cache kind, builder of InstrumentKernel.side) when the voice has
+        # spread partials, else None
+        voices = self._kernel_voices(instrument_type, sound, spec)
+        return voices[1] if voices is not None else None
+
+    def _kernel_voices(self, instrument_type, sound, spec):
+        if spec is None:
+            if instrument_type == "drum":
+                instrument_type = f"drum_{sound}"
+            spec = INSTRUMENT_SPECS.get(instrument_type)
+            if spec is None:
+                return None
+        # Renderers ask once per block, so voices are kept by spec object
+        # rather than compiled from the spec's JSON each time
+        cached = self._voices.get((instrument_type, id(spec)))
+        if cached is not None and cached[0] is spec:
+            return cached[1]
+        kernel = instrument_kernel(spec, instrument_type)
+        voice = (kernel.kind, lambda freq, duration: kernel.parts(self, freq, duration), kernel.pitched)
+        side = None
+        if kernel.spread:
+            side = (kernel.kind + ":side", lambda freq, duration: kernel.side(self, freq, duration))
+        if len(self._voices) >= MAX_INSTRUMENT_KERNELS:
+            self._voices.clear()
+        self._voices[(instrument_type, id(spec))] = (spec, (voice, side))
+        return voice, side
+
+    def _cache_key(self, kind, freq, samples, duration):
+        return (kind, freq, samples, duration, self.sample_rate, self.oscillator, self.interpolation,
+                self.dtype, self.quality)
+
+    def _note_parts(self, kind, freq, duration, build):
+        # freq is a frequency, None for unpitched voices or a sequence for a chord
+        if isinstance(freq, (tuple, list)):
+            return self.chord_parts(kind, tuple(freq), duration, build)
         samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            harmonics = [(1.0, freq), (0.3, freq * 2), (0.15, freq * 3), (0.07, freq * 4)]
-            for amp, harmonic_freq in harmonics:
-                wave += amp * np.sin(2 * np.pi * harmonic_freq * t)
-            pluck_noise = 0.1 * np.random.normal(0, 1, len(t)) * np.exp(-10 * t)
-            wood_resonance = 0.05 * np.sin(2 * np.pi * (freq/4) * t)
-            wave += pluck_noise + wood_resonance
-        envelope = self._create_guitar_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_guitar_envelope(self, duration):
+        if freq is not None and freq <= 0:
+            return np.zeros(samples, self.dtype), None
+        key = self._cache_key(kind, freq, samples, duration)
+        if self.note_cache is not None:
+            parts = self.note_cache.get(key)
+            if parts is not None:
+                return parts
+        parts = build(freq, duration)
+        if self.note_cache is not None:
+            self.note_cache.put(key, parts)
+        return parts
+
+    def chord_parts(self, kind, freqs, duration, build):
+        # All voices of a chord summed into a single tone, cached, noised and
+        # mixed as one note. Small chords are built as one (voices x samples)
+        # broadcast; past CHORD_BROADCAST_SAMPLES the temporaries fall out of
+        # cache and a loop over voices is faster, with the same samples. The
+        # noise envelope is scaled by sqrt(voices), the level of independent
+        # noise on each voice. Rest and unknown (<= 0) frequencies are skipped.
+        freqs = tuple(freq for freq in freqs if freq > 0)
+        if len(freqs) < 2:
+            return self._note_parts(kind, freqs[0] if freqs else 0.0, duration, build)
         samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.01, 0.2, 0.5, 0.1
-        attack_samples = int(attack * self.sample_rate)
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-        decay_samples = int(decay * self.sample_rate)
-        if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** 2
-        envelope[int((attack + decay) * self.sample_rate):] *= np.exp(-5 * t[int((attack + decay) * self.sample_rate):])
-        return envelope
+        key = self._cache_key(kind, freqs, samples, duration)
+        if self.note_cache is not None:
+            parts = self.note_cache.get(key)
+            if parts is not None:
+                return parts
+        if len(freqs) * samples <= CHORD_BROADCAST_SAMPLES:
+            tones, noise_envelope = build(np.array(freqs)[:, None], duration)
+            tone = tones.sum(axis=0)
+        else:
+            tone, noise_envelope = build(freqs[0], duration)
+            for freq in freqs[1:]:
+                tone += build(freq, duration)[0]
+        if noise_envelope is not None:
+            noise_envelope = noise_envelope * self.dtype.type(np.sqrt(len(freqs)))
+        parts = (tone, noise_envelope)
+        if self.note_cache is not None:
+            self.note_cache.put(key, parts)
+        return parts
 
-    def generate_bass(self, freq, duration, volume):
+    def note_parts_batch(self, kind, freqs, duration, build):
+        # Returns {freq: (tone, noise_envelope)}; all uncached frequencies are
+        # synthesized together as one (notes x samples) array.
         samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            harmonics = [(1.0, freq), (0.6, freq * 2), (0.3, freq * 3), (0.1, freq * 4)]
-            for amp, harmonic_freq in harmonics:
-                wave += amp * np.sin(2 * np.pi * harmonic_freq * t)
-            body_resonance = 0.15 * np.sin(2 * np.pi * (freq/2) * t)
-            string_noise = 0.02 * np.random.normal(0, 1, len(t))
-            wave += body_resonance + string_noise
-        envelope = self._create_bass_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_bass_envelope(self, duration):
+        parts = {}
+        missing = []
+        for freq in freqs:
+            if freq is None:
+                parts[freq] = self._note_parts(kind, freq, duration, build)
+            elif freq <= 0:
+                parts[freq] = (np.zeros(samples, self.dtype), None)
+            else:
+                key = self._cache_key(kind, freq, samples, duration)
+                cached = self.note_cache.get(key) if self.note_cache is not None else None
+                if cached is None:
+                    missing.append(freq)
+                else:
+                    parts[freq] = cached
+        if missing:
+            tones, noise_envelope = build(np.array(missing)[:, None], duration)
+            for freq, tone in zip(missing, tones):
+                parts[freq] = (tone, noise_envelope)
+                if self.note_cache is not None:
+                    key = self._cache_key(kind, freq, samples, duration)
+                    self.note_cache.put(key, parts[freq])
+        return parts
+
+    def noise(self, samples, rng=None, seed=None):
+        # Unit Gaussian noise in the synthesizer's dtype. With a noise bank it
+        # is a read-only window picked by seed (or by a draw from rng);
+        # otherwise, or when the bank is too short, fresh draws from rng,
+        # default_rng(seed) or self.rng.
+        with self._stage("noise"):
+            if self.noise_bank is not None:
+                key = seed if seed is not None else int((rng or self.rng).random() * 2 ** 53)
+                window = self.noise_bank.window(samples, key, self.dtype)
+                if window is not None:
+                    return window
+            if rng is None:
+                rng = np.random.default_rng(seed) if seed is not None else self.rng
+            # float32 casts float64 draws, so both dtypes hear the same noise
+            return rng.normal(0, 1, samples).astype(self.dtype, copy=False)
+
+    def _finish_note(self, parts, volume):
+        tone, noise_envelope = parts
+        if noise_envelope is None:
+            return volume * tone
+        return volume * (tone + self.noise(len(tone)) * noise_envelope)
+
+    def render_note(self, parts, volume, noise_seed, samples=None):
+        # The first `samples` samples of a timeline note. Its noise comes from
+        # its own seed, so any part of the note can be rendered on its own.
+        tone, noise_envelope = parts
+        tone = tone[:samples]
+        if noise_envelope is None:
+            return volume * tone
+        noise = self.noise(len(tone), seed=noise_seed)
+        wave = np.multiply(noise, noise_envelope[:len(tone)], out=noise if noise.flags.writeable else None)
+        wave += tone
+        wave *= volume
+        return wave
+
+    def drum_take(self, kind, duration, build, seed):
+        # One round-robin take of an unpitched voice at unit volume: the tone
+        # plus noise from seed, cached next to the notes as (take, None)
         samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.03, 0.1, 0.85, 0.15
-        attack_samples = int(attack * self.sample_rate)
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples) ** 1.5
-        decay_samples = int(decay * self.sample_rate)
-        if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** 1.2
-        sustain_start = int((attack + decay) * self.sample_rate)
-        sustain_end = int((duration - release) * self.sample_rate)
-        envelope[sustain_start:sustain_end] = sustain
-        if release_samples := int(release * self.sample_rate):
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** 0.8
-        return envelope
+        key = self._cache_key(kind, None, samples, duration) + (seed,)
+        parts = self.note_cache.get(key) if self.note_cache is not None else None
+        if parts is None:
+            parts = (self.render_note(self._note_parts(kind, None, duration, build), 1.0, seed), None)
+            if self.note_cache is not None:
+                self.note_cache.put(key, parts)
+        return parts[0]
+
+    def generate(self, instrument_type, freq, duration, volume):
+        voice = self.voice(instrument_type)
+        if voice is None:
+            raise ValueError(f"Unknown instrument type '{instrument_type}'")
+        kind, build, pitched = voice
+        return self._finish_note(self._note_parts(kind, freq if pitched else None, duration, build), volume)
+
+    def generate_violin(self, freq, duration, volume):
+        return self.generate("violin", freq, duration, volume)
+
+    def generate_cello(self, freq, duration, volume):
+        return self.generate("cello", freq, duration, volume)
+
+    def generate_acoustic_guitar(self, freq, duration, volume):
+        return self.generate("acoustic_guitar", freq, duration, volume)
+
+    def generate_bass(self, freq, duration, volume):
+        return self.generate("bass", freq, duration, volume)
 
     def generate_drum(self, freq, duration, volume, drum_type="kick"):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if drum_type == "kick":
-            # Low-frequency thump with quick decay
-            wave = np.sin(2 * np.pi * 60 * t) * np.exp(-15 * t)  # 60 Hz base
-            wave += 0.5 * np.random.normal(0, 1, samples) * np.exp(-20 * t)  # Noise burst
-        elif drum_type == "snare":
-            # Sharp noise with tonal component
-            wave = np.sin(2 * np.pi * 200 * t) * np.exp(-10 * t)  # 200 Hz tone
-            wave += np.random.normal(0, 1, samples) * np.exp(-12 * t)  # White noise
-        envelope = self._create_drum_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_drum_envelope(self, duration):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.exp(-15 * t)  # Fast decay for punchy drums
-        return envelope
+        # Drums ignore the note frequency, so every hit of a drum type shares one entry
+        return self.generate(f"drum_{drum_type}", freq, duration, volume)
 
     def generate_electric_guitar(self, freq, duration, volume):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            # Sawtooth-like wave with distortion
-            harmonics = [(1.0, freq), (0.8, freq * 2), (0.6, freq * 3), (0.4, freq * 4), (0.2, freq * 5)]
-            for amp, harmonic_freq in harmonics:
-                wave += amp * np.sin(2 * np.pi * harmonic_freq * t)
-            # Soft clipping for distortion
-            wave = np.tanh(wave * 2)
-            noise = 0.05 * np.random.normal(0, 1, len(t))
-            wave += noise
-        envelope = self._create_electric_guitar_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_electric_guitar_envelope(self, duration):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.01, 0.15, 0.7, 0.2
-        attack_samples = int(attack * self.sample_rate)
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-        decay_samples = int(decay * self.sample_rate)
-        if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples) ** 1.5
-        sustain_start = int((attack + decay) * self.sample_rate)
-        sustain_end = int((duration - release) * self.sample_rate)
-        envelope[sustain_start:sustain_end] = sustain
-        if release_samples := int(release * self.sample_rate):
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** 0.8
-        return envelope
+        return self.generate("electric_guitar", freq, duration, volume)
 
     def generate_synth_pad(self, freq, duration, volume):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        wave = np.zeros_like(t)
-        if freq > 0:
-            # Smooth, lush sound with multiple detuned waves
-            wave += np.sin(2 * np.pi * freq * t)
-            wave += 0.8 * np.sin(2 * np.pi * (freq * 1.01) * t)  # Slight detune
-            wave += 0.6 * np.sin(2 * np.pi * (freq * 0.99) * t)  # Slight detune
-            wave += 0.3 * np.sin(2 * np.pi * (freq * 2) * t)  # Octave up
-        envelope = self._create_synth_pad_envelope(duration)
-        return volume * wave * envelope
-
-    def _create_synth_pad_envelope(self, duration):
-        samples = int(self.sample_rate * duration)
-        t = np.linspace(0, duration, samples, False)
-        envelope = np.ones_like(t)
-        attack, decay, sustain, release = 0.2, 0.3, 0.6, 0.4
-        attack_samples = int(attack * self.sample_rate)
-        if attack_samples > 0:
-            envelope[:attack_samples] = np.linspace(0, 1, attack_samples) ** 1.5
-        decay_samples = int(decay * self.sample_rate)
-        if decay_samples > 0:
-            envelope[attack_samples:attack_samples+decay_samples] = np.linspace(1, sustain, decay_samples)
-        sustain_start = int((attack + decay) * self.sample_rate)
-        sustain_end = int((duration - release) * self.sample_rate)
-        envelope[sustain_start:sustain_end] = sustain
-        if release_samples := int(release * self.sample_rate):
-            envelope[-release_samples:] = np.linspace(sustain, 0, release_samples) ** 0.5
-        return envelope
+        return self.generate("synth_pad", freq, duration, volume)
+
+    def generate_piano(self, freq, duration, volume):
+        return self.generate("piano", freq, duration, volume)
 
 def generate_wave(freq, duration, sample_rate, volume):
     samples = int(sample_rate * duration)
@@ -252,86 +1218,1652 @@ def generate_wave(freq, duration, sample_rate, volume):
     envelope = np.exp(-t * 2)
     return volume * wave * envelope
 
-def create_advanced_music(json_file, output_file="advanced_output.wav"):
-    with open(json_file, 'r') as f:
-        config = json.load(f)
+SCORE_MAGIC = b"GGSCORE\0"
+SCORE_FORMAT_VERSION = 2
+SCORE_ALIGNMENT = 64
+SCORE_EVENT_DTYPE = np.dtype([
+    ("duration", "<f8"),
+    ("note", "<i4"),   # index into Score.notes, -1 when the event has no note name
+    ("sound", "<i4"),  # index into Score.sounds, -1 when the event has no sound
+    ("chord", "<i4"),  # index into Score.chords for a "notes" list, else -1
+])
 
-    sample_rate = config.get("sample_rate", 44100)
-    total_duration = config["total_duration"]
-    tempo = config["tempo"]
-    beat_duration = 60 / tempo
+class Score:
+    # A config with every pattern flattened into one event table; instrument
+    # i owns events[offsets[i]:offsets[i + 1]]. Anything the table cannot
+    # hold exactly (a non-float duration, a non-string name, other keys) is
+    # kept in extras by event index, so to_config() returns the original.
+    def __init__(self, settings, instruments, events, offsets, notes, sounds, chords=None, extras=None):
+        self.settings = settings
+        self.instruments = instruments
+        self.events = events
+        self.offsets = offsets
+        self.notes = notes
+        self.sounds = sounds
+        self.chords = chords or []  # lists of note names
+        self.extras = extras or {}
 
-    full_wave = np.zeros(int(sample_rate * total_duration))
-    synth = RealisticInstrumentSynthesizer(sample_rate)
+    def __len__(self):
+        return len(self.events)
 
-    for instrument in config["instruments"]:
-        pattern = instrument["pattern"]
-        volume = instrument["volume"]
-        pos = 0
+    def pattern(self, instrument_id):
+        return self.events[self.offsets[instrument_id]:self.offsets[instrument_id + 1]]
 
-        while pos < total_duration:
-            for event in pattern:
+    @classmethod
+    def from_config(cls, config):
+        settings = {key: value for key, value in config.items() if key != "instruments"}
+        instruments = []
+        note_ids, sound_ids, chord_ids = {}, {}, {}
+        durations, notes, sounds, chords = [], [], [], []
+        extras = {}
+        offsets = [0]
+        for instrument in config["instruments"]:
+            instruments.append({key: value for key, value in instrument.items() if key != "pattern"})
+            for event in instrument["pattern"]:
                 duration = event["duration"]
-                nominal_samples = int(sample_rate * duration)
-
-                vol_variation = volume * (0.9 + np.random.random() * 0.2)
-                time_offset = np.random.uniform(-0.01, 0.01)
-                pos = max(0, min(pos + time_offset, total_duration))
-
-                start = int(pos * sample_rate)
-                end = min(start + nominal_samples, len(full_wave))
-                target_samples = end - start
-
-                if target_samples <= 0 or start >= len(full_wave):
-                    break
-
-                wave = None
-                try:
-                    base_freq = NOTE_FREQ.get(event["note"], 0.0)
-                    freq = base_freq * (2 ** (instrument.get("pitch_shift", 0) / 12))
-                    if instrument["type"] == "violin":
-                        wave = synth.generate_violin(freq, duration, vol_variation)
-                    elif instrument["type"] == "cello":
-                        wave = synth.generate_cello(freq, duration, vol_variation)
-                    elif instrument["type"] == "acoustic_guitar":
-                        wave = synth.generate_acoustic_guitar(freq, duration, vol_variation)
-                    elif instrument["type"] == "bass":
-                        wave = synth.generate_bass(freq, duration, vol_variation)
-                    elif instrument["type"] == "piano":
-                        wave = generate_wave(freq, duration, sample_rate, vol_variation)
-                    elif instrument["type"] == "drum_kick":
-                        wave = synth.generate_drum(freq, duration, vol_variation, drum_type="kick")
-                    elif instrument["type"] == "drum_snare":
-                        wave = synth.generate_drum(freq, duration, vol_variation, drum_type="snare")
-                    elif instrument["type"] == "electric_guitar":
-                        wave = synth.generate_electric_guitar(freq, duration, vol_variation)
-                    elif instrument["type"] == "synth_pad":
-                        wave = synth.generate_synth_pad(freq, duration, vol_variation)
-                    if wave is None:
-                        wave = np.zeros(nominal_samples)
-                except Exception as e:
-                    print(f"Error generating wave for {instrument['type']}: {e}")
-                    wave = np.zeros(nominal_samples)
-
-                if len(wave) > target_samples:
-                    wave = wave[:target_samples]
-                elif len(wave) < target_samples:
-                    wave = np.pad(wave, (0, target_samples - len(wave)), 'constant')
-
-                full_wave[start:end] += wave
-
-                pos += duration
-                if pos >= total_duration and not instrument["repeat"]:
-                    break
-
-    max_amplitude = np.max(np.abs(full_wave))
-    if max_amplitude > 0:
-        full_wave = full_wave / (max_amplitude * 1.1)
-    full_wave = np.tanh(full_wave * 1.5)
-    
-    write(output_file, sample_rate, full_wave.astype(np.float32))
+                note = event.get("note")
+                sound = event.get("sound")
+                note = note_ids.setdefault(note, len(note_ids)) if type(note) is str else -1
+                sound = sound_ids.setdefault(sound, len(sound_ids)) if type(sound) is str else -1
+                chord = event.get("notes")
+                if type(chord) is list and all(type(name) is str for name in chord):
+                    chord = chord_ids.setdefault(tuple(chord), len(chord_ids))
+                else:
+                    chord = -1
+                if type(duration) is not float or len(event) != 1 + (note >= 0) + (sound >= 0) + (chord >= 0):
+                    stored = {"duration": type(duration) is float, "note": note >= 0, "sound": sound >= 0,
+                              "notes": chord >= 0}
+                    extras[len(durations)] = {key: value for key, value in event.items()
+                                              if not stored.get(key, False)}
+                durations.append(float(duration))
+                notes.append(note)
+                sounds.append(sound)
+                chords.append(chord)
+            offsets.append(len(durations))
+        events = np.zeros(len(durations), SCORE_EVENT_DTYPE)
+        events["duration"] = durations
+        events["note"] = notes
+        events["sound"] = sounds
+        events["chord"] = chords
+        return cls(settings, instruments, events, np.array(offsets, dtype=np.int64),
+                   list(note_ids), list(sound_ids), [list(chord) for chord in chord_ids], extras)
+
+    def to_config(self):
+        durations = self.events["duration"].tolist()
+        notes = self.events["note"].tolist()
+        sounds = self.events["sound"].tolist()
+        chords = self.events["chord"].tolist()
+        instruments = []
+        for instrument_id, instrument in enumerate(self.instruments):
+            pattern = []
+            for index in range(self.offsets[instrument_id], self.offsets[instrument_id + 1]):
+                event = {}
+                if notes[index] >= 0:
+                    event["note"] = self.notes[notes[index]]
+                if sounds[index] >= 0:
+                    event["sound"] = self.sounds[sounds[index]]
+                if chords[index] >= 0:
+                    event["notes"] = list(self.chords[chords[index]])
+                event["duration"] = durations[index]
+                event.update(self.extras.get(index, {}))
+                pattern.append(event)
+            instruments.append(dict(instrument, pattern=pattern))
+        return dict(self.settings, instruments=instruments)
+
+    def save(self, path):
+        # Magic, version and header length, a JSON header, then the event
+        # table at an aligned offset so load() can map it in place
+        header = json.dumps({"settings": self.settings, "instruments": self.instruments,
+                             "notes": self.notes, "sounds": self.sounds, "chords": self.chords,
+                             "offsets": self.offsets.tolist(),
+                             "extras": {str(index): extra for index, extra in self.extras.items()}}).encode()
+        start = 16 + len(header)
+        padding = -start % SCORE_ALIGNMENT
+        with open(path, "wb") as f:
+            f.write(SCORE_MAGIC + struct.pack("<II", SCORE_FORMAT_VERSION, len(header) + padding))
+            f.write(header + b" " * padding)
+            f.write(np.ascontiguousarray(self.events, SCORE_EVENT_DTYPE).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        # The event table is memory-mapped read-only, not copied
+        with open(path, "rb") as f:
+            prefix = f.read(16)
+            if prefix[:8] != SCORE_MAGIC:
+                raise ValueError(f"{path} is not a score file")
+            version, header_bytes = struct.unpack("<II", prefix[8:])
+            if version != SCORE_FORMAT_VERSION:
+                raise ValueError(f"Unsupported score version in {path}")
+            header = json.loads(f.read(header_bytes))
+        offsets = np.array(header["offsets"], dtype=np.int64)
+        if offsets[-1]:
+            events = np.memmap(path, SCORE_EVENT_DTYPE, mode="r", offset=16 + header_bytes, shape=(int(offsets[-1]),))
+        else:
+            events = np.zeros(0, SCORE_EVENT_DTYPE)
+        return cls(header["settings"], header["instruments"], events, offsets, header["notes"], header["sounds"],
+                   header["chords"], {int(index): extra for index, extra in header["extras"].items()})
+
+def load_score(path):
+    # A binary score or a JSON config, told apart by the score magic
+    with open(path, "rb") as f:
+        binary = f.read(len(SCORE_MAGIC)) == SCORE_MAGIC
+    if binary:
+        return Score.load(path)
+    with open(path, "r") as f:
+        return Score.from_config(json.load(f))
+
+TIMELINE_DTYPE = np.dtype([
+    ("start_sample", np.int64),
+    ("n_samples", np.int64),     # samples actually played (clipped at the song's end)
+    ("duration", np.float64),    # nominal note length, which fixes the envelope
+    ("freq", np.float64),
+    ("volume", np.float64),      # humanized
+    ("instrument_id", np.int32),
+    ("articulation", np.int32),  # index into ARTICULATIONS
+    ("noise_seed", np.uint64),
+    ("chord", np.int32),         # index into Timeline.chords, or -1 for a single note
+])
+ARTICULATIONS = ("note", "kick", "snare", "hihat")
+TIMELINE_FORMAT_VERSION = 2
+
+def _pattern_arrays(score, instrument_id):
+    # Per event of one instrument: duration, unshifted frequency, articulation
+    # (-1 for a drum sound that cannot be rendered), whether it is a rest and
+    # its index into score.chords. Lookups go through the small name tables,
+    # never per event.
+    instrument = score.instruments[instrument_id]
+    pattern = score.pattern(instrument_id)
+    note_freqs = np.array([NOTE_FREQ.get(note, 0.0) for note in score.notes] + [0.0])
+    note_rests = np.array([note == "REST" for note in score.notes] + [False])
+    sound_rests = np.array([sound == "REST" for sound in score.sounds] + [False])
+    if instrument["type"] == "drum":
+        sounds = np.array([ARTICULATIONS.index(sound) if sound in ARTICULATIONS else -1
+                           for sound in score.sounds] + [-1], dtype=np.int32)
+        articulations = sounds[pattern["sound"]]
+    else:
+        sound = {"drum_kick": "kick", "drum_snare": "snare", "drum_hihat": "hihat"}.get(instrument["type"], "note")
+        articulations = np.full(len(pattern), ARTICULATIONS.index(sound), dtype=np.int32)
+    rests = note_rests[pattern["note"]] | sound_rests[pattern["sound"]]
+    return (np.array(pattern["duration"]), note_freqs[pattern["note"]], articulations, rests,
+            np.array(pattern["chord"]))
+
+class Timeline:
+    # Every note of a config as one start-sorted structured array, with
+    # humanization applied and a noise seed per note. Renderers only read it,
+    # so one timeline can feed the in-memory, streaming and parallel paths.
+    def __init__(self, events, instruments, sample_rate, total_samples, seed, chords=(), channels=1):
+        self.events = events
+        self.instruments = instruments
+        self.sample_rate = sample_rate
+        self.total_samples = total_samples
+        self.seed = seed
+        self.chords = chords  # tuples of pitch-shifted voice frequencies
+        self.channels = channels  # of the mix (see output_channels)
+        self._onsets = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def select(self, index):
+        # A timeline over a subset of the events (slice, mask or index array)
+        return Timeline(self.events[index], self.instruments, self.sample_rate, self.total_samples, self.seed,
+                        self.chords, self.channels)
+
+    def _onset_index(self):
+        # Per instrument: event positions, their sorted onsets and the longest note
+        if self._onsets is None:
+            self._onsets = []
+            order = np.argsort(self.events["instrument_id"], kind="stable")  # onsets stay sorted
+            counts = np.bincount(self.events["instrument_id"], minlength=len(self.instruments))
+            for positions in np.split(order, np.cumsum(counts)[:-1]):
+                if len(positions):
+                    self._onsets.append((positions, self.events["start_sample"][positions],
+                                         int(self.events["n_samples"][positions].max())))
+        return self._onsets
+
+    def window(self, start, end):
+        # The events sounding anywhere in samples [start, end), including notes
+        # that started earlier, in timeline order
+        picked = []
+        for positions, onsets, longest in self._onset_index():
+            first = np.searchsorted(onsets, start - longest, side="right")
+            last = np.searchsorted(onsets, end)
+            candidates = positions[first:last]
+            events = self.events[candidates]
+            picked.append(candidates[events["start_sample"] + events["n_samples"] > start])
+        return self.select(np.sort(np.concatenate(picked)) if picked else slice(0, 0))
+
+    def save(self, path):
+        meta = {"version": TIMELINE_FORMAT_VERSION, "instruments": self.instruments,
+                "sample_rate": self.sample_rate, "total_samples": self.total_samples, "seed": self.seed,
+                "chords": self.chords, "channels": self.channels}
+        with open(path, "wb") as f:
+            np.savez(f, events=self.events, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != TIMELINE_FORMAT_VERSION:
+                raise ValueError(f"Unsupported timeline version in {path}")
+            return cls(data["events"], meta["instruments"], meta["sample_rate"], meta["total_samples"], meta["seed"],
+                       [tuple(chord) for chord in meta["chords"]], meta.get("channels", 1))
+
+def _instrument_notes(score, instrument_id):
+    # _pattern_arrays pitch-shifted, with each chord voiced: a chord keeps its
+    # first max_voices known notes and a single one plays as a note. The
+    # chord column then indexes the returned voicings.
+    instrument = score.instruments[instrument_id]
+    durations, freqs, articulations, rests, chords = _pattern_arrays(score, instrument_id)
+    shift = 2 ** (instrument.get("pitch_shift", 0) / 12)
+    freqs = freqs * shift
+    max_voices = instrument.get("max_voices", MAX_CHORD_VOICES)
+    voicings = []
+    for position in np.flatnonzero((chords >= 0) & (articulations == 0)).tolist():
+        voicing = tuple(NOTE_FREQ[name] * shift for name in score.chords[chords[position]]
+                        if NOTE_FREQ.get(name, 0.0) > 0)[:max_voices]
+        freqs[position] = voicing[0] if voicing else 0.0
+        chords[position] = len(voicings) if len(voicing) > 1 else -1
+        if len(voicing) > 1:
+            voicings.append(voicing)
+    chords[articulations != 0] = -1
+    return durations, freqs, articulations, rests, chords, voicings
+
+def _note_events(instrument, instrument_id, notes, index, starts, n_samples, variation, noise_seeds):
+    # Timeline events playing pattern events `index` of _instrument_notes at
+    # starts, with their volume variation and noise seeds
+    durations, freqs, articulations, rests, chords, _ = notes
+    events = np.zeros(len(index), TIMELINE_DTYPE)
+    events["start_sample"] = starts
+    events["n_samples"] = n_samples
+    events["duration"] = durations[index]
+    events["freq"] = freqs[index]
+    events["volume"] = instrument["volume"] * (0.9 + variation * 0.2)
+    events["instrument_id"] = instrument_id
+    events["articulation"] = articulations[index]
+    events["noise_seed"] = noise_seeds
+    events["chord"] = chords[index]
+    # Rests play nothing, on drums too; pitched notes also need a known note
+    # name, and drum hits a sound that has a voice
+    played = ~rests[index] & (articulations[index] >= 0)
+    played &= (events["articulation"] != 0) | (events["freq"] > 0)
+    return events[played]
+
+def _compile_instrument(score, instrument_id, sample_rate, total_duration, total_samples, rng, noise_rng=None):
+    # The humanized walk pos = max(0, pos + jitter) + duration is a Lindley
+    # recursion, so onsets are a cumulative sum minus its running minimum.
+    instrument = score.instruments[instrument_id]
+    notes = _instrument_notes(score, instrument_id)
+    durations, voicings = notes[0], notes[5]
+    nominal = (sample_rate * durations).astype(np.int64)
+    if len(durations) == 0 or nominal.min() <= 0:
+        return np.zeros(0, TIMELINE_DTYPE), []  # a zero-length note never advances the walk
+    repeat = instrument.get("repeat", False)
+
+    chunks = []
+    pos = 0.0
+    first = 0
+    count = int(len(durations) * (total_duration / durations.sum() + 1)) + 16
+    while True:
+        index = (first + np.arange(count)) % len(durations)
+        variation = rng.random(count)
+        jitter = rng.uniform(-0.01, 0.01, count)
+        steps = jitter.copy()
+        steps[0] += pos
+        steps[1:] += durations[index[:-1]]
+        walk = np.cumsum(steps)
+        onsets = np.minimum(walk - np.minimum(np.minimum.accumulate(walk), 0.0), total_duration)
+        starts = (onsets * sample_rate).astype(np.int64)
+        stops = np.flatnonzero(starts >= total_samples)
+        stop = stops[0] if len(stops) else count
+        if not repeat:
+            ends = np.flatnonzero(onsets[:stop] + durations[index[:stop]] >= total_duration)
+            if len(ends):
+                stop = ends[0] + 1
+        chunks.append((index[:stop], starts[:stop], variation[:stop]))
+        if stop < count:
+            break
+        pos = onsets[-1] + durations[index[-1]]
+        first = (first + count) % len(durations)
+
+    index = np.concatenate([chunk[0] for chunk in chunks])
+    starts = np.concatenate([chunk[1] for chunk in chunks])
+    variation = np.concatenate([chunk[2] for chunk in chunks])
+    return _note_events(instrument, instrument_id, notes, index, starts,
+                        np.minimum(starts + nominal[index], total_samples) - starts, variation,
+                        (noise_rng or rng).integers(0, 2 ** 63, len(index), dtype=np.int64)), voicings
+
+def compile_timeline(config, sample_rate=None, seed=None, noise_seed=None):
+    # config is a config dict or a Score. Each instrument walks with its own
+    # generator, so a track's notes do not depend on the other tracks.
+    # seed=None draws fresh entropy, kept in timeline.seed so the render can
+    # be repeated. With noise_seed, note noise seeds come from it instead of
+    # seed: the k-th note of an instrument gets the same noise whatever the
+    # humanization, which is how render_variations shares notes between takes.
+    score = config if isinstance(config, Score) else Score.from_config(config)
+    instruments = _resolve_specs(score.instruments, score.settings)
+    sample_rate = sample_rate or score.settings.get("sample_rate", 44100)
+    total_duration = score.settings["total_duration"]
+    total_samples = int(sample_rate * total_duration)
+    root = np.random.SeedSequence(seed)
+    parts = []
+    chords = []
+    for instrument_id in range(len(score.instruments)):
+        rng = np.random.default_rng(np.random.SeedSequence(root.entropy, spawn_key=(instrument_id,)))
+        noise_rng = None
+        if noise_seed is not None:
+            noise_rng = np.random.default_rng(np.random.SeedSequence(noise_seed, spawn_key=(instrument_id,)))
+        events, voicings = _compile_instrument(score, instrument_id, sample_rate, total_duration, total_samples,
+                                               rng, noise_rng)
+        events["chord"][events["chord"] >= 0] += len(chords)
+        chords.extend(voicings)
+        parts.append(events)
+    events = np.concatenate(parts) if parts else np.zeros(0, TIMELINE_DTYPE)
+    events = events[np.argsort(events["start_sample"], kind="stable")]
+    return Timeline(events, instruments, sample_rate, total_samples, root.entropy, chords,
+                    output_channels(score.settings, instruments))
+
+DEFAULT_LOOP_TAKES = 4  # humanized takes of the cycle per looping instrument with loop_bake
+LOOP_GAIN_JITTER = 0.03  # a baked cycle plays at 1 +/- this of its take's level
+LOOP_OFFSET_JITTER = 0.005  # seconds a baked cycle may start early or late
+
+class LoopBake:
+    # The looping instruments of a config as a few humanized takes of one
+    # pattern cycle each, laid end to end in the `cycles` timeline, and per
+    # instrument where every cycle of the song starts, which take it plays
+    # and at what gain
+    def __init__(self, cycles, placements):
+        self.cycles = cycles
+        self.placements = placements  # [(first sample in cycles, take length, takes, starts, picks, gains)]
+
+def _compile_cycles(score, instrument_id, sample_rate, takes, rng):
+    # `takes` humanized plays of one cycle of an instrument's pattern, each
+    # from sample 0 with its notes' full lengths: the walk of
+    # _compile_instrument, restarted on the beat every cycle
+    instrument = score.instruments[instrument_id]
+    notes = _instrument_notes(score, instrument_id)
+    durations = notes[0]
+    index = np.arange(len(durations))
+    cycles = []
+    for _ in range(takes):
+        variation = rng.random(len(durations))
+        steps = rng.uniform(-0.01, 0.01, len(durations))
+        steps[1:] += durations[:-1]
+        walk = np.cumsum(steps)
+        onsets = walk - np.minimum(np.minimum.accumulate(walk), 0.0)
+        cycles.append(_note_events(instrument, instrument_id, notes, index, (onsets * sample_rate).astype(np.int64),
+                                   (sample_rate * durations).astype(np.int64), variation,
+                                   rng.integers(0, 2 ** 63, len(durations), dtype=np.int64)))
+    return cycles, notes[5]
+
+def compile_loops(config, sample_rate=None, seed=None, takes=DEFAULT_LOOP_TAKES):
+    # (timeline of the instruments that do not loop, LoopBake of those that
+    # do) for render_loops. An instrument loops when it repeats a pattern
+    # shorter than the song; its "loop_takes" overrides takes. Cycle k starts
+    # at k pattern lengths, up to LOOP_OFFSET_JITTER early or late, and plays
+    # a take other than the previous cycle's.
+    score = config if isinstance(config, Score) else Score.from_config(config)
+    timeline = compile_timeline(score, sample_rate, seed)
+    sample_rate = timeline.sample_rate
+    total_duration = score.settings["total_duration"]
+    root = np.random.SeedSequence(timeline.seed)
+    looping = np.zeros(len(score.instruments), bool)
+    chords = list(timeline.chords)
+    parts = []
+    placements = []
+    length = 0
+    for instrument_id, instrument in enumerate(score.instruments):
+        durations = np.array(score.pattern(instrument_id)["duration"])
+        cycle = float(durations.sum())
+        if (not instrument.get("repeat", False) or not len(durations) or not 0 < cycle < total_duration
+                or (sample_rate * durations).astype(np.int64).min() <= 0):
+            continue
+        count = instrument.get("loop_takes", takes)
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise ValueError(f"{instrument['type']}: loop_takes must be a positive integer")
+        looping[instrument_id] = True
+        # Takes are drawn from their own generator, so adding a take keeps the others
+        rng = np.random.default_rng(np.random.SeedSequence(root.entropy, spawn_key=(instrument_id, 1)))
+        cycles, voicings = _compile_cycles(score, instrument_id, sample_rate, count, rng)
+        stride = max((int((events["start_sample"] + events["n_samples"]).max()) for events in cycles if len(events)),
+                     default=0)
+        if stride == 0:
+            continue  # only rests
+        for take, events in enumerate(cycles):
+            events["start_sample"] += length + take * stride
+            events["chord"][events["chord"] >= 0] += len(chords)
+            parts.append(events)
+        chords.extend(voicings)
+
+        jitter = min(int(LOOP_OFFSET_JITTER * sample_rate), int(cycle * sample_rate) // 4)  # starts stay in order
+        cycles_played = int(math.ceil(total_duration / cycle))
+        starts = (np.arange(cycles_played) * cycle * sample_rate).astype(np.int64)
+        starts = np.maximum(starts + rng.integers(-jitter, jitter + 1, cycles_played), 0)
+        picks = np.cumsum(rng.integers(1, max(count, 2), cycles_played)) % count
+        gains = 1 + rng.uniform(-LOOP_GAIN_JITTER, LOOP_GAIN_JITTER, cycles_played)
+        placements.append((length, stride, count, starts, picks, gains))
+        length += count * stride
+
+    events = np.concatenate(parts) if parts else np.zeros(0, TIMELINE_DTYPE)
+    events = events[np.argsort(events["start_sample"], kind="stable")]
+    cycles = Timeline(events, timeline.instruments, sample_rate, length, timeline.seed, chords, timeline.channels)
+    return timeline.select(~looping[timeline.events["instrument_id"]]), LoopBake(cycles, placements)
+
+MAX_CHANNELS = 8
+_AXPY = {np.dtype(np.float32): blas.saxpy, np.dtype(np.float64): blas.daxpy}
+
+def output_channels(settings, instruments):
+    # The config's "channels": by default 2 when an instrument has a "pan"
+    # (-1 first channel, 0 centre, 1 last) or a "width" (0 to 1), otherwise 1,
+    # so configs without either render mono as before
+    for instrument in instruments:
+        for key, low in (("pan", -1), ("width", 0)):
+            value = instrument.get(key, 0)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= 1:
+                raise ValueError(f"{instrument['type']} {key} must be a number from {low} to 1")
+    panned = any("pan" in instrument or "width" in instrument for instrument in instruments)
+    channels = settings.get("channels", 2 if panned else 1)
+    if isinstance(channels, bool) or not isinstance(channels, int) or not 1 <= channels <= MAX_CHANNELS:
+        raise ValueError(f"channels must be a whole number from 1 to {MAX_CHANNELS}")
+    return channels
+
+def pan_gains(pan, channels):
+    # Constant-power gains of a source at pan along a row of channels, -1 at
+    # the first and 1 at the last: the two channels either side of it share
+    # it as the cosine and sine of its position between them
+    gains = np.zeros(channels)
+    if channels == 1:
+        gains[0] = 1.0
+        return gains
+    position = (pan + 1) / 2 * (channels - 1)
+    left = min(int(position), channels - 2)
+    angle = (position - left) * np.pi / 2
+    gains[left], gains[left + 1] = np.cos(angle), np.sin(angle)
+    return gains
+
+def _bus_shape(samples, buses, channels):
+    # Mix buffers: samples, or interleaved (samples, channels), after a row
+    # index when there are effect buses
+    shape = (samples,) if channels == 1 else (samples, channels)
+    return (1 + len(buses),) + shape if buses else shape
+
+def _channel_levels(instruments, sends, channels):
+    # Per instrument, (row, channel gains, side gains) for the dry row and each
+    # of its sends, which are post-pan. Side gains take InstrumentKernel.side
+    # to either side of the pan position by the instrument's "width".
+    spread = np.linspace(-1, 1, channels)
+    levels = []
+    for instrument, instrument_sends in zip(instruments, sends):
+        gains = pan_gains(instrument.get("pan", 0), channels)
+        side = gains * spread * instrument.get("width", 0)
+        levels.append([(row, level * gains, level * side) for row, level in [(0, 1.0)] + instrument_sends])
+    return levels
+
+def _pan_add(bus, position, wave, gains):
+    # bus[position:position + len(wave), c] += gains[c] * wave on an
+    # interleaved (samples, channels) bus, in place: BLAS axpy walks each
+    # channel at a stride, so no scaled copy of the note is made
+    wave = wave.astype(bus.dtype, copy=False)
+    channels = bus.shape[1]
+    if bus.flags.c_contiguous:
+        flat = bus.reshape(-1)
+        axpy = _AXPY[bus.dtype]
+        for channel, gain in enumerate(gains.tolist()):
+            if gain:
+                axpy(wave, flat, len(wave), gain, offy=position * channels + channel, incy=channels)
+    else:
+        for channel, gain in enumerate(gains.tolist()):
+            if gain:
+                bus[position:position + len(wave), channel] += gain * wave
+
+TRAIN_SEGMENT = 1 << 18  # samples of the mix convolved at a time by _mix_train
+TRAIN_FFT_OVERLAP = 96  # hits overlapping a sample, on average, before an FFT beats scatter-add
+
+def _mix_train(out, positions, velocities, take):
+    # Adds velocity * take at each position (relative to out[0], possibly
+    # negative; sorted). Segment by segment, sparse hits are added directly
+    # and dense ones as one FFT convolution of the trigger train with the take.
+    length = len(take)
+    if length == 0:
+        return
+    for begin in range(0, len(out), TRAIN_SEGMENT):
+        end = min(begin + TRAIN_SEGMENT, len(out))
+        first, last = np.searchsorted(positions, [begin - length + 1, end])
+        if first == last:
+            continue
+        span = end - begin + length - 1
+        if (last - first) * length < TRAIN_FFT_OVERLAP * span:
+            for position, velocity in zip(positions[first:last].tolist(), velocities[first:last].tolist()):
+                lo, hi = max(position, begin), min(position + length, end)
+                out[lo:hi] += velocity * take[lo - position:hi - position]
+        else:
+            train = np.bincount(positions[first:last] - (begin - length + 1),
+                                weights=velocities[first:last], minlength=span)
+            out[begin:end] += fftconvolve(train.astype(out.dtype, copy=False), take)[length - 1:span]
+
+def _render_trains(timeline, synth, out, offset, voices, hits, sends, levels=None):
+    # percussion="trains": each unpitched sound and length is rendered as
+    # synth.drum_takes noise-varied takes, and every hit picks one by its
+    # noise seed, so the choice does not depend on which events are rendered.
+    # A multichannel mix takes _channel_levels as levels.
+    events = timeline.events[hits]
+    takes = events["noise_seed"] % np.uint64(synth.drum_takes)
+    keys = np.stack([events["instrument_id"], events["articulation"], takes.astype(np.int64)])
+    profiler = synth.profiler
+    for duration in np.unique(events["duration"]).tolist():
+        same_length = events["duration"] == duration
+        for instrument_id, articulation, take in np.unique(keys[:, same_length], axis=1).T.tolist():
+            voice = voices[instrument_id][articulation]
+            if voice is None:
+                continue
+            began = time.perf_counter() if profiler is not None else 0.0
+            kind, build, _ = voice
+            seed = np.random.SeedSequence(timeline.seed, spawn_key=(instrument_id, articulation, take))
+            try:
+                wave = synth.drum_take(kind, duration, build, int(seed.generate_state(1, np.uint64)[0]))
+            except Exception as e:
+                print(f"Error generating wave for {timeline.instruments[instrument_id]['type']}: {e}")
+                continue
+            group = same_length & (keys[0] == instrument_id) & (keys[1] == articulation) & (keys[2] == take)
+            with synth._stage("mix"):
+                positions = events["start_sample"][group] - offset
+                volumes = events["volume"][group]
+                if levels is not None:
+                    rows = out if out.ndim == 3 else out[None]
+                    for row, gains, _ in levels[instrument_id]:
+                        for channel, gain in enumerate(gains.tolist()):
+                            if gain:
+                                _mix_train(rows[row][:, channel], positions, volumes * gain, wave)
+                elif out.ndim == 1:
+                    _mix_train(out, positions, volumes, wave)
+                else:
+                    _mix_train(out[0], positions, volumes, wave)
+                    for row, level in sends[instrument_id]:
+                        _mix_train(out[row], positions, volumes * level, wave)
+            if profiler is not None:
+                profiler.note(timeline.instruments[instrument_id]["type"], wave, time.perf_counter() - began)
+
+def _timeline_voices(timeline, synth):
+    # synth.voice per instrument and articulation
+    return [[synth.voice(instrument["type"], sound, instrument.get("spec")) for sound in ARTICULATIONS]
+            for instrument in timeline.instruments]
+
+def _timeline_sides(timeline, synth):
+    # synth.side_voice per instrument with a "width", None for the others
+    return [synth.side_voice(instrument["type"], spec=instrument.get("spec")) if instrument.get("width") else None
+            for instrument in timeline.instruments]
+
+def _side_parts(synth, side_voice, chords, duration, freq, chord):
+    kind, build = side_voice
+    return synth._note_parts(kind, chords[chord] if chord >= 0 else freq, duration, build)[0]
+
+def _mix_panned(rows, position, levels, wave, scale, side=None, side_scale=0.0):
+    # Adds scale * wave, and side_scale * side spread by the side gains, to
+    # every row of a multichannel mix that the note's instrument plays in
+    for row, gains, side_gains in levels:
+        _pan_add(rows[row], position, wave, gains * scale)
+        if side is not None:
+            _pan_add(rows[row], position, side, side_gains * side_scale)
+
+def _batch_parts(synth, voices, events):
+    # {(instrument_id, articulation, duration): {freq: parts}} with the
+    # distinct single notes of each key synthesized together, or the
+    # exception that stopped them
+    groups = {}
+    for duration, freq, instrument_id, articulation, chord in zip(
+            *(events[name].tolist() for name in ("duration", "freq", "instrument_id", "articulation", "chord"))):
+        voice = voices[instrument_id][articulation]
+        if voice is not None and chord < 0:
+            groups.setdefault((instrument_id, articulation, duration), set()).add(freq if voice[2] else None)
+    for key, freqs in groups.items():
+        kind, build, _ = voices[key[0]][key[1]]
+        try:
+            groups[key] = synth.note_parts_batch(kind, freqs, key[2], build)
+        except Exception as e:
+            groups[key] = e
+    return groups
+
+def _event_parts(synth, voice, chords, groups, instrument_id, articulation, duration, freq, chord):
+    kind, build, pitched = voice
+    if chord >= 0:
+        return synth.chord_parts(kind, chords[chord], duration, build)
+    if groups is not None:
+        parts = groups[(instrument_id, articulation, duration)]
+        if isinstance(parts, Exception):
+            raise parts
+        return parts[freq if pitched else None]
+    return synth._note_parts(kind, freq if pitched else None, duration, build)
+
+def render_timeline(timeline, synth, out=None, offset=0, batch=False, buses=()):
+    # Mixes the timeline's notes into out, where out[0] is sample `offset` of
+    # the song; parts before out[0] or past its end are dropped. With batch,
+    # the distinct notes of each instrument and length are synthesized
+    # together first. Either way the samples are the same. With effect buses
+    # (EffectsBus.names), out has a row per bus after the dry row, and notes
+    # are also mixed into the buses their instrument sends to. A timeline
+    # with several channels mixes into interleaved (samples, channels) rows,
+    # each note panned by its instrument's "pan" and "width".
+    if out is None:
+        length = max(timeline.total_samples - offset, 0)
+        out = np.zeros(_bus_shape(length, buses, timeline.channels), synth.dtype)
+    dry = out[0] if buses else out
+    sends = _send_levels(timeline.instruments, buses)
+    levels = sides = None
+    if timeline.channels > 1:
+        levels = _channel_levels(timeline.instruments, sends, timeline.channels)
+        sides = _timeline_sides(timeline, synth)
+        rows = out if buses else out[None]
+    events = timeline.events
+    voices = _timeline_voices(timeline, synth)
+    if synth.percussion == "trains":
+        hits = events["articulation"] > 0
+        _render_trains(timeline, synth, out, offset, voices, hits, sends, levels)
+        events = events[~hits]
+    columns = [events[name].tolist() for name in ("start_sample", "n_samples", "duration", "freq", "volume",
+                                                  "instrument_id", "articulation", "noise_seed", "chord")]
+    groups = _batch_parts(synth, voices, events) if batch else None
+
+    profiler = synth.profiler
+    for start, samples, duration, freq, volume, instrument_id, articulation, noise_seed, chord in zip(*columns):
+        voice = voices[instrument_id][articulation]
+        if voice is None:
+            continue
+        began = time.perf_counter() if profiler is not None else 0.0
+        try:
+            parts = _event_parts(synth, voice, timeline.chords, groups, instrument_id, articulation, duration,
+                                 freq, chord)
+            wave = synth.render_note(parts, volume, noise_seed, samples)
+            side = None
+            if sides is not None and sides[instrument_id] is not None:
+                side = _side_parts(synth, sides[instrument_id], timeline.chords, duration, freq, chord)
+        except Exception as e:
+            print(f"Error generating wave for {timeline.instruments[instrument_id]['type']}: {e}")
+            continue
+        with synth._stage("mix"):
+            position = start - offset
+            skip = max(0, -position)
+            if skip:
+                wave = wave[skip:]
+                position = 0
+            end = min(position + len(wave), len(dry))
+            if end > position and levels is not None:
+                _mix_panned(rows, position, levels[instrument_id], wave[:end - position], 1.0,
+                            side[skip:skip + end - position] if side is not None else None, volume)
+            elif end > position:
+                dry[position:end] += wave[:end - position]
+                for row, level in sends[instrument_id]:
+                    out[row, position:end] += level * wave[:end - position]
+        if profiler is not None:
+            profiler.note(timeline.instruments[instrument_id]["type"], wave, time.perf_counter() - began)
+    return out
+
+def _render_span(timeline, synth, first, last, batch, effects):
+    # Samples [first, last) of the unmastered mix, zero outside the song.
+    # Effects start from a pre-roll of their tail, aligned to the partition
+    # grid of the whole song's reverbs.
+    if effects is None:
+        out = np.zeros(_bus_shape(last - first, (), timeline.channels), synth.dtype)
+        return render_timeline(timeline.window(first, last), synth, out, first, batch)
+    alignment = effects.alignment()
+    begin = max(0, (first - effects.tail_samples()) // alignment * alignment)
+    begin = min(begin, first)
+    rows = np.zeros(_bus_shape(last - begin, effects.names, timeline.channels), synth.dtype)
+    render_timeline(timeline.window(begin, last), synth, rows, begin, batch, effects.names)
+    effects.reset()
+    with synth._stage("effects"):
+        wave = effects.process(rows[:, :max(0, timeline.total_samples - begin)])
+    padding = np.zeros((last - begin - len(wave),) + wave.shape[1:], wave.dtype)
+    return np.concatenate([wave, padding])[first - begin:]
+
+def render_window(timeline, synth, start, end, batch=False, sample_rate=None, effects=None):
+    # The unmastered mix of samples [start, end). Only notes sounding in the
+    # window are synthesized, and they are mixed in timeline order, so the
+    # result is sample-identical to the same slice of render_timeline.
+    # With a sample_rate other than the timeline's, start and end count
+    # samples at that rate, and the window plus a filter margin is rendered
+    # and resampled; the result is the same slice of resample(render_timeline).
+    # With an EffectsBus, the effects hear a pre-roll of their tail first; the
+    # result matches the full render up to delay repeats below -80 dB.
+    if sample_rate is not None and sample_rate != timeline.sample_rate:
+        up, down = _resample_ratio(timeline.sample_rate, sample_rate)
+        margin = _resample_margin(up, down)
+        start = max(0, start)
+        end = min(end, resampled_length(timeline.total_samples, timeline.sample_rate, sample_rate))
+        if end <= start:
+            return np.zeros(_bus_shape(0, (), timeline.channels), synth.dtype)
+        # Starting on a multiple of down puts the window on the whole
+        # signal's polyphase grid; samples past the song stay zero
+        first = start * down // up // down * down - margin
+        last = -(-end * down // up) + margin
+        wave = _render_span(timeline, synth, first, last, batch, effects)
+        with synth._stage("resample"):
+            wave = resample_poly(wave, up, down)
+        skip = start - first * up // down
+        return wave[skip:skip + end - start]
+    start = max(0, start)
+    end = min(end, timeline.total_samples)
+    return _render_span(timeline, synth, start, max(start, end), batch, effects)
+
+def render_variations(timelines, synth, out=None, batch=False, buses=()):
+    # Mixes takes of one score into out[take], rows as in render_timeline (a
+    # dry row, then one per bus). The takes must be compiled with the same
+    # noise_seed, so the k-th note of an instrument differs between takes
+    # only in onset and volume. Each such note is rendered once at unit
+    # volume and mixed into every take that plays it. Take i matches
+    # render_timeline(timelines[i]) up to rounding: notes are summed in
+    # another order.
+    base = timelines[0]
+    if out is None:
+        out = np.zeros((len(timelines), 1 + len(buses)) + _bus_shape(base.total_samples, (), base.channels),
+                       synth.dtype)
+    sends = _send_levels(base.instruments, buses)
+    levels = sides = None
+    if base.channels > 1:
+        levels = _channel_levels(base.instruments, sends, base.channels)
+        sides = _timeline_sides(base, synth)
+    voices = _timeline_voices(base, synth)
+    parts = []
+    for take, timeline in enumerate(timelines):
+        events = timeline.events
+        if synth.percussion == "trains":
+            hits = events["articulation"] > 0
+            _render_trains(timeline, synth, out[take] if buses else out[take, 0], 0, voices, hits, sends, levels)
+            events = events[~hits]
+        parts.append(events)
+    takes = np.repeat(np.arange(len(timelines)), [len(events) for events in parts])
+    events = np.concatenate(parts)
+    # Copies of one note are adjacent; a note cut short by the end of the
+    # song is rendered on its own, since bank noise depends on the length
+    order = np.lexsort((takes, events["n_samples"], events["noise_seed"], events["instrument_id"]))
+    events, takes = events[order], takes[order].tolist()
+    if len(events):
+        new = np.diff(events["instrument_id"]) != 0
+        new |= np.diff(events["noise_seed"]) != 0
+        new |= np.diff(events["n_samples"]) != 0
+        firsts = np.concatenate([[0], np.flatnonzero(new) + 1])
+    else:
+        firsts = np.zeros(0, np.int64)
+    ends = np.append(firsts[1:], len(events)).tolist()
+    groups = _batch_parts(synth, voices, events[firsts]) if batch else None
+    starts = events["start_sample"].tolist()
+    volumes = events["volume"].tolist()
+    columns = [events[name][firsts].tolist() for name in ("n_samples", "duration", "freq", "instrument_id",
+                                                          "articulation", "noise_seed", "chord")]
+
+    profiler = synth.profiler
+    for first, end, samples, duration, freq, instrument_id, articulation, noise_seed, chord in zip(
+            firsts.tolist(), ends, *columns):
+        voice = voices[instrument_id][articulation]
+        if voice is None:
+            continue
+        began = time.perf_counter() if profiler is not None else 0.0
+        try:
+            wave = synth.render_note(_event_parts(synth, voice, base.chords, groups, instrument_id, articulation,
+                                                  duration, freq, chord), 1.0, noise_seed, samples)
+            side = None
+            if sides is not None and sides[instrument_id] is not None:
+                side = _side_parts(synth, sides[instrument_id], base.chords, duration, freq, chord)[:samples]
+        except Exception as e:
+            print(f"Error generating wave for {base.instruments[instrument_id]['type']}: {e}")
+            continue
+        with synth._stage("mix"):
+            for take, start, volume in zip(takes[first:end], starts[first:end], volumes[first:end]):
+                if levels is not None:
+                    _mix_panned(out[take], start, levels[instrument_id], wave, volume, side, volume)
+                    continue
+                note = volume * wave
+                out[take, 0, start:start + samples] += note
+                for row, level in sends[instrument_id]:
+                    out[take, row, start:start + samples] += level * note
+        if profiler is not None:
+            profiler.note(base.instruments[instrument_id]["type"], wave, time.perf_counter() - began)
+    return out
+
+LOOP_MIX_BLOCK = 1 << 15  # samples of the mix render_loops fills from every instrument at a time
+
+def render_loops(timeline, loops, synth, batch=False, buses=()):
+    # The mix of compile_loops: the timeline rendered as usual, and each
+    # looping instrument's takes rendered once and overlap-added at its cycle
+    # starts, each cycle scaled by its gain. A take runs on past its cycle by
+    # the tails of its last notes, which ring over the next cycle's start.
+    # Cycles are added with BLAS axpy over all interleaved channels, block by
+    # block, so a block of the mix stays in cache while every instrument is
+    # added to it.
+    out = render_timeline(timeline, synth, batch=batch, buses=buses)
+    if not loops.placements:
+        return out
+    takes = render_timeline(loops.cycles, synth, batch=batch, buses=buses)
+    channels = timeline.channels
+    total = timeline.total_samples
+    mix = out.reshape(-1, total * channels)
+    baked = takes.reshape(-1, loops.cycles.total_samples * channels)
+    axpy = _AXPY[out.dtype]
+    # (row, take starts in the row, stride, cycle starts, picks, gains) of the rows each instrument plays in
+    plays = [(row, begin, stride, starts, picks, gains)
+             for begin, stride, count, starts, picks, gains in loops.placements
+             for row in range(len(mix)) if baked[row, begin * channels:(begin + count * stride) * channels].any()]
+    with synth._stage("mix"):
+        for block in range(0, total, LOOP_MIX_BLOCK):
+            end = min(block + LOOP_MIX_BLOCK, total)
+            for row, begin, stride, starts, picks, gains in plays:
+                first, last = np.searchsorted(starts, [block - stride + 1, end])
+                for start, take, gain in zip(starts[first:last].tolist(), picks[first:last].tolist(),
+                                             gains[first:last].tolist()):
+                    lo, hi = max(start, block), min(start + stride, end)
+                    axpy(baked[row], mix[row], (hi - lo) * channels, gain,
+                         offx=(begin + take * stride + lo - start) * channels, offy=lo * channels)
+    return out
+
+DEFAULT_BLOCK_SIZE = 65536
+
+def render_blocks(timeline, synth, block_size=DEFAULT_BLOCK_SIZE, buses=()):
+    # Yields the unmastered mix in consecutive blocks of block_size samples.
+    # Each note is rendered once, when its block starts; the part that crosses
+    # the block boundary stays in the carry region of the mix buffer. Memory is
+    # bounded by block_size plus the longest note, whatever the song length.
+    # A yielded block is only valid until the next one is requested. With
+    # effect buses, blocks have a row per bus as in render_timeline.
+    starts = timeline.events["start_sample"]
+    longest = int(timeline.events["n_samples"].max()) if len(timeline) else 0
+    mix = np.zeros(_bus_shape(block_size + longest, buses, timeline.channels), synth.dtype)
+    rows = mix if buses else mix[None]  # time is the second axis of rows
+    for block_start in range(0, timeline.total_samples, block_size):
+        block_end = min(block_start + block_size, timeline.total_samples)
+        first, last = np.searchsorted(starts, [block_start, block_end])
+        render_timeline(timeline.select(slice(first, last)), synth, mix, block_start, buses=buses)
+        yield mix[:, :block_end - block_start] if buses else mix[:block_end - block_start]
+        rows[:, :-block_size] = rows[:, block_size:]
+        rows[:, -block_size:] = 0
+
+def apply_effects(blocks, effects, synth):
+    # Runs consecutive mix blocks with bus rows through a freshly reset EffectsBus
+    effects.reset()
+    for rows in blocks:
+        with synth._stage("effects"):
+            block = effects.process(rows)
+        yield block
+
+def _resample_ratio(from_rate, to_rate):
+    divisor = math.gcd(int(from_rate), int(to_rate))
+    return int(to_rate) // divisor, int(from_rate) // divisor
+
+def _resample_margin(up, down):
+    # Input samples either side of an output sample that resample_poly's
+    # filter reaches, rounded up to a multiple of down
+    reach = -(-10 * max(up, down) // up) + 1
+    return -(-reach // down) * down
+
+def resampled_length(samples, from_rate, to_rate):
+    up, down = _resample_ratio(from_rate, to_rate)
+    return -(-samples * up // down)
+
+def resample(wave, from_rate, to_rate):
+    # Polyphase FIR resampling (scipy.signal.resample_poly) in wave's dtype
+    up, down = _resample_ratio(from_rate, to_rate)
+    if up == down:
+        return wave
+    return resample_poly(wave, up, down)
+
+def resample_blocks(blocks, from_rate, to_rate, samples):
+    # Resamples a stream of consecutive blocks holding `samples` input samples.
+    # Each step resamples the unconsumed input plus a filter margin from a
+    # multiple of down, so the yielded blocks are sample-identical to the same
+    # slices of resample() on the whole signal.
+    up, down = _resample_ratio(from_rate, to_rate)
+    if up == down:
+        yield from blocks
+        return
+    margin = _resample_margin(up, down)
+    total = resampled_length(samples, from_rate, to_rate)
+    history = None
+    base = -margin  # input index of history[0]
+    done = 0
+    for block in itertools.chain(blocks, [None]):
+        if history is None:
+            if block is None:
+                history = np.zeros(margin)
+            else:
+                history = np.zeros((margin,) + block.shape[1:], block.dtype)
+        if block is None:
+            # The end of the song: the rest, against the zeros the signal ends in
+            block = np.zeros((max(0, -(-total * down // up) + margin - (base + len(history))),) + history.shape[1:],
+                             history.dtype)
+            ready = total
+        else:
+            ready = min(total, (base + len(history) + len(block) - margin) * up // down)
+        history = np.concatenate([history, block])
+        if ready > done:
+            wave = resample_poly(history, up, down)
+            skip = done - base * up // down
+            yield wave[skip:skip + ready - done]
+            done = ready
+        start = (done * down // up - margin) // down * down
+        history = history[start - base:]
+        base = start
+
+DEFAULT_REVERB_PARTITION = 16384  # samples per impulse response partition
+REVERB_BATCH_PARTITIONS = 16  # input partitions transformed at a time, bounding temporaries
+DELAY_TAIL_LEVEL = 1e-4  # delay repeats below this level (-80 dB) are left out of window pre-rolls
+
+def reverb_ir(sample_rate, decay=2.0, length=None, predelay=0.02, damping=0.5, seed=0):
+    # An algorithmic room: Gaussian noise decaying by 60 dB over `decay`
+    # seconds, with its high band (above about 2 kHz) decaying faster as
+    # damping goes from 0 to 1, after `predelay` seconds of silence.
+    # Normalized to unit energy, so a send comes back at about its own level.
+    samples = int(sample_rate * (length if length is not None else decay))
+    t = np.arange(samples) / sample_rate
+    noise = np.random.default_rng(seed).standard_normal(samples)
+    pole = np.exp(-2 * np.pi * 2000 / sample_rate)
+    low = lfilter([1 - pole], [1, -pole], noise)
+    high_decay = decay * (1 - 0.8 * min(max(damping, 0.0), 1.0))
+    ir = low * np.exp(-6.91 * t / decay) + (noise - low) * np.exp(-6.91 * t / high_decay)
+    ir = np.concatenate([np.zeros(int(sample_rate * predelay)), ir])
+    energy = np.sqrt(np.sum(ir ** 2))
+    return ir / energy if energy > 0 else ir
+
+def load_impulse_response(path, sample_rate):
+    # A WAV impulse response as mono float64 at sample_rate, unit energy
+    file_rate, data = read_wav(path)
+    if data.dtype.kind in "iu":
+        info = np.iinfo(data.dtype)
+        data = (data.astype(np.float64) - (info.max + info.min + 1) / 2) / (info.max - info.min + 1) * 2
+    data = data.astype(np.float64, copy=False)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if file_rate != sample_rate:
+        data = resample(data, file_rate, sample_rate)
+    energy = np.sqrt(np.sum(data ** 2))
+    return data / energy if energy > 0 else data
+
+class ConvolutionReverb:
+    # Uniformly partitioned overlap-save convolution. The impulse response is
+    # split into partitions of `partition` samples whose spectra are kept; each
+    # input partition is transformed once, stored in a frequency-domain delay
+    # line, and every output partition is the sum of spectra products of the
+    # last K input partitions with the K IR partitions. Blocks of any length
+    # can be fed in; a trailing partial partition is output from its
+    # zero-padded spectrum and transformed again once it is complete, so the
+    # output never lags the input. Blocks that are multiples of the partition
+    # give the same samples as one call on the whole signal.
+    def __init__(self, ir, partition=DEFAULT_REVERB_PARTITION):
+        self.partition = partition
+        self.length = len(ir)
+        count = max(1, -(-len(ir) // partition))
+        padded = np.zeros((count, 2 * partition))
+        padded[:, :partition].flat[:len(ir)] = ir
+        self.spectra = np.fft.rfft(padded)
+        self.reset()
+
+    def reset(self):
+        partition = self.partition
+        self._history = np.zeros((len(self.spectra) - 1, partition + 1), complex)  # oldest first
+        self._previous = np.zeros(partition)
+        self._pending = np.zeros(0)
+
+    def process(self, x):
+        out = np.empty(len(x))
+        step = REVERB_BATCH_PARTITIONS * self.partition
+        for begin in range(0, len(x), step):
+            out[begin:begin + step] = self._process(x[begin:begin + step])
+        return out
+
+    def _process(self, x):
+        partition = self.partition
+        pending = len(self._pending)
+        buffer = np.concatenate([self._pending, x])
+        full = len(buffer) // partition
+        frames = -(-len(buffer) // partition)
+        chunks = np.zeros((frames, partition))
+        chunks.flat[:len(buffer)] = buffer
+        # Overlap-save: each frame is the previous partition and this one
+        spectra = np.fft.rfft(np.concatenate([np.concatenate([self._previous[None], chunks[:-1]]), chunks], axis=1))
+        line = np.concatenate([self._history, spectra])
+        count = len(self.spectra)
+        wet = np.zeros((frames, partition + 1), complex)
+        for k in range(count):
+            wet += self.spectra[k] * line[count - 1 - k:count - 1 - k + frames]
+        y = np.fft.irfft(wet, 2 * partition)[:, partition:].reshape(-1)
+        # Only complete partitions enter the delay line
+        kept = line[:count - 1 + full]
+        self._history = kept[len(kept) - (count - 1):]
+        if full:
+            self._previous = chunks[full - 1].copy()
+        self._pending = buffer[full * partition:].copy()
+        return y[pending:len(buffer)]
+
+    def tail_samples(self):
+        # Input older than this no longer reaches the output
+        return -(-self.length // self.partition) * self.partition
+
+class FeedbackDelay:
+    # w[n] = x[n] + feedback * w[n - samples], output w[n - samples]: repeats
+    # every `samples` samples, each `feedback` times the last. Vectorized in
+    # runs of at most `samples`, the span over which w only depends on the past.
+    def __init__(self, samples, feedback):
+        if samples < 1:
+            raise ValueError("Delay time must be at least one sample")
+        if not 0 <= feedback < 1:
+            raise ValueError("Delay feedback must be in [0, 1)")
+        self.samples = samples
+        self.feedback = feedback
+        self.reset()
+
+    def reset(self):
+        self._line = np.zeros(self.samples)
+
+    def process(self, x):
+        delay = self.samples
+        line = np.concatenate([self._line, np.zeros(len(x))])
+        for begin in range(0, len(x), delay):
+            end = min(begin + delay, len(x))
+            line[delay + begin:delay + end] = x[begin:end] + self.feedback * line[begin:end]
+        self._line = line[len(x):]
+        return line[:len(x)]
+
+    def tail_samples(self):
+        repeats = 1
+        if self.feedback > 0:
+            repeats += int(np.ceil(np.log(DELAY_TAIL_LEVEL) / np.log(self.feedback)))
+        return repeats * self.samples
+
+class EffectsBus:
+    # Send/return effects after the mix. The mix is rendered as rows: row 0
+    # is the dry bus, row i + 1 the send bus of names[i], fed by each
+    # instrument's "sends" levels. process() returns the dry bus plus every
+    # effect's output times its return level. Effects keep state between
+    # calls, so consecutive blocks give the same result as the whole mix.
+    # A multichannel mix has interleaved (samples, channels) rows, and every
+    # effect runs one processor per channel.
+    def __init__(self, effects):
+        self.effects = effects  # [(name, [processor per channel], return level)]
+        self.names = tuple(name for name, _, _ in effects)
+
+    def _processors(self):
+        return [processor for _, processors, _ in self.effects for processor in processors]
+
+    def reset(self):
+        for processor in self._processors():
+            processor.reset()
+
+    def tail_samples(self):
+        # Input older than this no longer reaches the output (to -80 dB)
+        return max((processor.tail_samples() for processor in self._processors()), default=0)
+
+    def alignment(self):
+        # Rendering from a multiple of this keeps reverbs on the same partition grid
+        return math.lcm(*(processor.partition for processor in self._processors()
+                          if isinstance(processor, ConvolutionReverb)))
+
+    def process(self, rows):
+        out = rows[0].copy()
+        for row, (_, processors, level) in enumerate(self.effects, 1):
+            if out.ndim == 1:
+                out += (level * processors[0].process(rows[row])).astype(out.dtype, copy=False)
+                continue
+            for channel, processor in enumerate(processors):
+                out[:, channel] += (level * processor.process(rows[row][:, channel])).astype(out.dtype, copy=False)
+        return out
+
+    @classmethod
+    def from_settings(cls, settings, sample_rate, base_dir=None, channels=1):
+        # settings is the config's "effects" object: {name: spec}. A spec has a
+        # "type" (default: the name), "reverb" or "delay", and a "return" level.
+        # Reverbs load "ir" (a WAV path relative to base_dir; not allowed
+        # without one) or generate one from "decay", "length", "predelay",
+        # "damping" and "seed". Delays take "time" seconds and "feedback".
+        # Invalid effects are reported and left out. Returns None for no effects.
+        # Generated reverbs use seed + c on channel c, so a centred source
+        # gets a wide reverb; a loaded IR is shared by every channel.
+        effects = []
+        for name, spec in (settings or {}).items():
+            try:
+                kind = spec.get("type", name)
+                if kind == "reverb":
+                    partition = spec.get("partition", DEFAULT_REVERB_PARTITION)
+                    if "ir" in spec:
+                        if base_dir is None:
+                            raise ValueError("impulse response files are not allowed here")
+                        ir = load_impulse_response(os.path.join(base_dir, spec["ir"]), sample_rate)
+                        processors = [ConvolutionReverb(ir, partition)]
+                    else:
+                        irs = [reverb_ir(sample_rate, spec.get("decay", 2.0), spec.get("length"),
+                                         spec.get("predelay", 0.02), spec.get("damping", 0.5),
+                                         spec.get("seed", 0) + channel)
+                               for channel in range(channels)]
+                        processors = [ConvolutionReverb(ir, partition) for ir in irs]
+                elif kind == "delay":
+                    processors = [FeedbackDelay(int(round(spec["time"] * sample_rate)), spec.get("feedback", 0.35))]
+                else:
+                    raise ValueError(f"unknown effect type '{kind}'")
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                print(f"Error creating effect {name}: {e}")
+                continue
+            # The other channels run copies of the first processor, which
+            # share its impulse response spectra
+            while len(processors) < channels:
+                processor = copy.copy(processors[0])
+                processor.reset()
+                processors.append(processor)
+            effects.append((name, processors, spec.get("return", 0.3)))
+        return cls(effects) if effects else None
+
+def _send_levels(instruments, buses):
+    # Per instrument, the (row, level) pairs of its non-zero sends
+    return [[(row, instrument.get("sends", {}).get(name, 0.0)) for row, name in enumerate(buses, 1)
+             if instrument.get("sends", {}).get(name, 0.0)] for instrument in instruments]
+
+def master(wave, peak):
+    # Peak normalization followed by tanh soft clipping, in place on wave
+    if peak > 0:
+        wave /= peak * 1.1
+    wave *= 1.5
+    return np.tanh(wave, out=wave)
+
+def _peak(wave):
+    # max(abs(wave)) without an absolute copy of the mix
+    return float(max(wave.max(), -wave.min())) if wave.size else 0.0
+
+class WavWriter:
+    # Incremental 32-bit float WAV writer with the same header layout as
+    # scipy.io.wavfile.write. Chunk sizes are patched on close when the file is
+    # seekable; pass frames up front to write a final header for pipes/sockets.
+    def __init__(self, target, sample_rate, channels=1, frames=0):
+        self._owns_file = isinstance(target, (str, bytes)) or hasattr(target, "__fspath__")
+        self.file = open(target, "wb") if self._owns_file else target
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.file.write(self._header(frames))
+
+    def _header(self, frames):
+        data_bytes = frames * self.channels * 4
+        fmt_chunk = struct.pack('<HHIIHHH', 3, self.channels, self.sample_rate,
+                                self.sample_rate * self.channels * 4, self.channels * 4, 32, 0)
+        header = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk
+        header += b'fact' + struct.pack('<II', 4, frames)
+        header += b'data' + struct.pack('<I', data_bytes)
+        return b'RIFF' + struct.pack('<I', len(header) + data_bytes) + header
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype='<f4')
+        self.file.write(block.tobytes())
+        self.frames += len(block)
+
+    def close(self):
+        if self.file.seekable():
+            self.file.seek(0)
+            self.file.write(self._header(self.frames))
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stream_music(timeline, synth, output_file, block_size=DEFAULT_BLOCK_SIZE, progress=None, sample_rate=None,
+                 effects=None):
+    # Two passes over the timeline: the first finds the global peak, the second
+    # masters each block and appends it to the WAV. Notes carry their own noise
+    # seeds, so both passes render the same samples as the in-memory path. The
+    # header is final from the start, so output_file can be a pipe or socket.
+    # progress is called as progress(pass_number, samples_done, total_samples)
+    # after every block and may raise to abort the render. A sample_rate other
+    # than the timeline's resamples the blocks (see resample_blocks). An
+    # EffectsBus is reset for each pass.
+    sample_rate = sample_rate or timeline.sample_rate
+    total_samples = resampled_length(timeline.total_samples, timeline.sample_rate, sample_rate)
+
+    def blocks():
+        if effects is None:
+            mixed = render_blocks(timeline, synth, block_size)
+        else:
+            mixed = apply_effects(render_blocks(timeline, synth, block_size, effects.names), effects, synth)
+        return resample_blocks(mixed, timeline.sample_rate, sample_rate, timeline.total_samples)
+
+    peak = 0.0
+    done = 0
+    for block in blocks():
+        peak = max(peak, _peak(block))
+        done += len(block)
+        if progress is not None:
+            progress(1, done, total_samples)
+    done = 0
+    with WavWriter(output_file, sample_rate, timeline.channels, total_samples) as writer:
+        for block in blocks():
+            with synth._stage("master"):
+                block = master(block, peak)
+            with synth._stage("write"):
+                writer.write(block)
+            done += len(block)
+            if progress is not None:
+                progress(2, done, total_samples)
+
+MIN_SLICE_SECONDS = 15.0  # shorter tracks are not split across workers
+
+_cached_synths = {}
+
+def cached_synth(sample_rate, oscillator="sine", interpolation="linear", note_cache_bytes=DEFAULT_NOTE_CACHE_BYTES,
+                 dtype=np.float64, percussion="notes", noise_bank_bytes=0, quality="normal"):
+    # One synthesizer per process and settings, so caches stay warm across
+    # renders. sample_rate is the render rate of the quality level.
+    key = (sample_rate, oscillator, interpolation, note_cache_bytes, np.dtype(dtype), percussion, noise_bank_bytes,
+           quality)
+    synth = _cached_synths.get(key)
+    if synth is None:
+        note_cache = NoteCache(note_cache_bytes) if note_cache_bytes else None
+        synth = RealisticInstrumentSynthesizer(sample_rate, note_cache=note_cache, oscillator=oscillator,
+                                               interpolation=interpolation, dtype=dtype, percussion=percussion,
+                                               noise_bank=NoiseBank(noise_bank_bytes) if noise_bank_bytes else None,
+                                               quality=quality)
+        _cached_synths[key] = synth
+    return synth
+
+def _track_jobs(timeline, workers):
+    # Tracks are split into time slices when there are more workers than
+    # tracks; each job carries the timeline events that start in its slice.
+    total_samples = timeline.total_samples
+    total_duration = total_samples / timeline.sample_rate
+    instruments = timeline.instruments
+    slices = max(1, min(-(-workers // max(len(instruments), 1)), int(total_duration // MIN_SLICE_SECONDS)))
+    slice_samples = -(-total_samples // slices)
+    events = timeline.events
+    jobs = []
+    offset = 0
+    for track in range(len(instruments)):
+        track_events = np.flatnonzero(events["instrument_id"] == track)
+        starts = events["start_sample"][track_events]
+        for index in range(slices):
+            start = index * slice_samples
+            end = min(start + slice_samples, total_samples)
+            if start >= end:
+                continue
+            first, last = np.searchsorted(starts, [start, end])
+            if first == last:
+                continue
+            job_timeline = timeline.select(track_events[first:last])
+            length = int((job_timeline.events["start_sample"] + job_timeline.events["n_samples"]).max()) - start
+            jobs.append({"track": track, "slice": index, "start": start, "offset": offset, "length": length,
+                         "timeline": job_timeline})
+            offset += length
+    return jobs, offset
+
+def _render_job(job, synth, out):
+    render_timeline(job["timeline"], synth, out, job["start"])
+
+def _render_job_shared(job, shm_name, shape, synth_options):
+    synth = cached_synth(**synth_options)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        stems = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        _render_job(job, synth, stems[job["offset"]:job["offset"] + job["length"]])
+        del stems
+    finally:
+        shm.close()
+
+def render_parallel(timeline, workers, synth_options, buses=()):
+    # Renders float32 stems on a process pool through one shared-memory block
+    # and mixes them in job order, which keeps the sum bit-identical per seed.
+    # With effect buses, stems are also mixed into the buses their track
+    # sends to, as in render_timeline.
+    jobs, total_length = _track_jobs(timeline, workers)
+    full_wave = np.zeros(_bus_shape(timeline.total_samples, buses, timeline.channels),
+                         synth_options.get("dtype", np.float64))
+    if total_length == 0:
+        return full_wave
+    shape = _bus_shape(total_length, (), timeline.channels)
+    if workers == 1:
+        stems = np.zeros(shape, dtype=np.float32)
+        synth = cached_synth(**synth_options)
+        for job in jobs:
+            _render_job(job, synth, stems[job["offset"]:job["offset"] + job["length"]])
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=total_length * timeline.channels * 4)
+        try:
+            stems = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            stems[:] = 0
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_render_job_shared, job, shm.name, shape, synth_options)
+                           for job in jobs]
+                for future in futures:
+                    future.result()
+            stems = stems.copy()
+        finally:
+            shm.close()
+            shm.unlink()
+    dry = full_wave[0] if buses else full_wave
+    sends = _send_levels(timeline.instruments, buses)
+    for job in jobs:
+        stem = stems[job["offset"]:job["offset"] + job["length"]]
+        dry[job["start"]:job["start"] + job["length"]] += stem
+        for row, level in sends[job["track"]]:
+            full_wave[row, job["start"]:job["start"] + job["length"]] += level * stem
+    return full_wave
+
+DEFAULT_STEM_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+STEM_FORMAT_VERSION = 4
+
+class StemCache:
+    # Rendered instrument stems as float32 .npy files named by a content hash.
+    # File modification times double as LRU order; eviction keeps the directory
+    # under max_bytes.
+    def __init__(self, directory, max_bytes=DEFAULT_STEM_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, instrument, sample_rate, total_duration, seed, synth, channels=1):
+        payload = {
+            "version": STEM_FORMAT_VERSION,
+            "instrument": instrument,
+            "sample_rate": sample_rate,
+            "total_duration": total_duration,
+            "seed": seed,
+            "oscillator": synth.oscillator,
+            "interpolation": synth.interpolation,
+            "dtype": synth.dtype.name,
+            "percussion": synth.percussion,
+            "noise_bank": [synth.noise_bank.max_bytes, synth.noise_bank.seed] if synth.noise_bank else None,
+            "quality": synth.quality,
+        }
+        if channels > 1:
+            payload["channels"] = channels  # mono stems keep their keys
+        signature = _sample_signature(instrument.get("spec"))
+        if signature is not None:
+            payload["samples"] = signature
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stem = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return stem
+
+    def put(self, key, stem):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, stem.astype(np.float32))
+        os.replace(tmp_path, path)
+
+    def evict(self, keep=()):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, name[:-4], path))
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, key, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key not in keep:
+                os.remove(path)
+                total -= size
+
+def render_with_stems(config, synth, stem_cache, seed, batch=False, buses=()):
+    # Each instrument gets its own timeline seeded from the seed and its content
+    # hash, so editing one instrument leaves every other stem valid. Stems are
+    # dry: send levels are applied when mixing them into the effect buses, and
+    # changing them re-renders nothing. A multichannel stem is panned.
+    sample_rate = synth.sample_rate
+    total_duration = config["total_duration"]
+    samples = int(sample_rate * total_duration)
+    channels = output_channels(config, config["instruments"])
+    full_wave = np.zeros(_bus_shape(samples, buses, channels), synth.dtype)
+    dry = full_wave[0] if buses else full_wave
+    sends = _send_levels(config["instruments"], buses)
+    used = set()
+    for instrument, instrument_sends in zip(_resolve_specs(config["instruments"], config), sends):
+        instrument = {key: value for key, value in instrument.items() if key != "sends"}
+        key = stem_cache.key(instrument, sample_rate, total_duration, seed, synth, channels)
+        used.add(key)
+        stem = stem_cache.get(key)
+        if stem is None:
+            timeline = compile_timeline(dict(config, instruments=[instrument], channels=channels), sample_rate,
+                                        [0 if seed is None else seed, int(key[:16], 16)])
+            stem = render_timeline(timeline, synth, batch=batch)
+            stem_cache.put(key, stem)
+            stem = stem.astype(np.float32)  # mix exactly what a later run loads
+        dry += stem
+        for row, level in instrument_sends:
+            full_wave[row] += level * stem
+    stem_cache.evict(keep=used)
+    return full_wave
+
+def _master_and_write(synth, full_wave, output_file, sample_rate, peak=None):
+    # Masters the mix in place and writes it a block at a time, so a float64
+    # mix is never copied whole to float32
+    with synth._stage("master"):
+        full_wave = master(full_wave, _peak(full_wave) if peak is None else peak)
+    with synth._stage("write"):
+        channels = full_wave.shape[1] if full_wave.ndim == 2 else 1
+        with WavWriter(output_file, sample_rate, channels, len(full_wave)) as writer:
+            for begin in range(0, len(full_wave), DEFAULT_BLOCK_SIZE):
+                writer.write(full_wave[begin:begin + DEFAULT_BLOCK_SIZE])
+
+def _prepare_render(json_file, synth, note_cache_bytes, oscillator, interpolation, dtype, percussion,
+                    noise_bank_bytes, quality):
+    # The score (with an instrument_specs file loaded), a synthesizer at the
+    # render rate and the effects bus, with the config's problems reported
+    if quality not in QUALITY_LEVELS:
+        raise ValueError(f"Unknown quality '{quality}'")
+    score = load_score(json_file)
+    base_dir = os.path.dirname(os.path.abspath(json_file))
+    specs = score.settings.get("instrument_specs")
+    if isinstance(specs, str):
+        # A path relative to the config
+        score.settings["instrument_specs"] = load_instrument_specs(os.path.join(base_dir, specs))
+    elif isinstance(specs, dict):
+        score.settings["instrument_specs"] = {name: _sample_paths(spec, base_dir) for name, spec in specs.items()}
+    # Sample paths are relative to the config too
+    score.instruments = [_sample_paths(dict(instrument, spec=_sample_paths(instrument["spec"], base_dir))
+                                       if "spec" in instrument else instrument, base_dir)
+                         for instrument in score.instruments]
+    rate = render_rate(score.settings.get("sample_rate", 44100), quality)
+
+    # A caller-provided synthesizer keeps its caches, oscillator settings,
+    # dtype, percussion mode and noise bank
+    if synth is None or synth.sample_rate != rate or synth.quality != quality:
+        note_cache = NoteCache(note_cache_bytes) if note_cache_bytes else None
+        synth = RealisticInstrumentSynthesizer(rate, note_cache=note_cache, oscillator=oscillator,
+                                               interpolation=interpolation, dtype=dtype, percussion=percussion,
+                                               noise_bank=NoiseBank(noise_bank_bytes) if noise_bank_bytes else None,
+                                               quality=quality)
+    effects = EffectsBus.from_settings(score.settings.get("effects"), rate,
+                                       os.path.dirname(os.path.abspath(json_file)),
+                                       output_channels(score.settings, score.instruments))
+    buses = effects.names if effects is not None else ()
+
+    for instrument_id, instrument in enumerate(_resolve_specs(score.instruments, score.settings)):
+        for name in instrument.get("sends", {}):
+            if name not in buses:
+                print(f"Warning: {instrument['type']} sends to unknown effect '{name}'")
+        if instrument["type"] == "drum":
+            _, _, articulations, rests, _ = _pattern_arrays(score, instrument_id)
+            unknown = np.unique(score.pattern(instrument_id)["sound"][(articulations < 0) & ~rests])
+            for index in unknown.tolist():
+                print(f"Error generating wave for drum: unknown sound '{score.sounds[index] if index >= 0 else None}'")
+        elif synth.voice(instrument["type"], spec=instrument.get("spec")) is None:
+            print(f"Error generating wave for {instrument['type']}: unknown instrument type")
+        chords = np.unique(score.pattern(instrument_id)["chord"])
+        voices = max((len(score.chords[chord]) for chord in chords.tolist() if chord >= 0), default=0)
+        if voices > instrument.get("max_voices", MAX_CHORD_VOICES):
+            print(f"Warning: {instrument['type']} has chords of up to {voices} notes; only the first "
+                  f"{instrument.get('max_voices', MAX_CHORD_VOICES)} are played")
+    return score, synth, effects
+
+def create_advanced_music(json_file, output_file="advanced_output.wav", note_cache_bytes=DEFAULT_NOTE_CACHE_BYTES,
+                          batch=False, seed=None, oscillator="sine", interpolation="linear",
+                          stream=False, block_size=DEFAULT_BLOCK_SIZE, workers=None, synth=None,
+                          stem_cache_dir=None, stem_cache_bytes=DEFAULT_STEM_CACHE_BYTES, dtype=np.float64,
+                          profile=None, profile_trace=None, start=None, end=None, peak=None, percussion="notes",
+                          noise_bank_bytes=0, quality="normal", loop_bake=False, loop_takes=DEFAULT_LOOP_TAKES):
+    # json_file may also be a binary score (Score.save / convert_score.py).
+    # quality="draft" or "high" synthesizes at render_rate(sample_rate,
+    # quality) and resamples the mix to sample_rate before mastering. The
+    # config's "effects" run on the mix (at the render rate) before that.
+    # loop_bake renders each looping instrument as loop_takes takes of its
+    # cycle (see compile_loops), in memory only.
+    if loop_bake and (start is not None or end is not None or stream or workers or stem_cache_dir):
+        raise ValueError("loop_bake renders the whole song in memory; it cannot be combined with start/end, "
+                         "stream, workers or stem_cache_dir")
+    started = time.perf_counter()
+    score, synth, effects = _prepare_render(json_file, synth, note_cache_bytes, oscillator, interpolation, dtype,
+                                            percussion, noise_bank_bytes, quality)
+    sample_rate = score.settings.get("sample_rate", 44100)
+    total_duration = score.settings["total_duration"]
+    tempo = score.settings["tempo"]
+    beat_duration = 60 / tempo
+    rate = synth.sample_rate
+    note_cache = synth.note_cache
+    buses = effects.names if effects is not None else ()
+
+    synth.envelopes.reset_counters()
+    previous_profiler = synth.profiler
+    if profile or profile_trace:
+        synth.profiler = Profiler(trace=profile_trace is not None)
+    profiler = synth.profiler
+    windowed = start is not None or end is not None
+    # Windows, streaming and workers render from the timeline, not the stem cache
+    if windowed or stream or workers or not stem_cache_dir:
+        with synth._stage("compile"):
+            if loop_bake:
+                timeline, loops = compile_loops(score, rate, seed, loop_takes)
+            else:
+                timeline = compile_timeline(score, rate, seed)
+
+    if windowed:
+        # Only the [start, end) seconds; mastered with the window's own peak
+        # unless the caller passes the full render's peak
+        first = int(sample_rate * (start or 0))
+        last = int(sample_rate * end) if end is not None else int(sample_rate * total_duration)
+        with synth._stage("render"):
+            full_wave = render_window(timeline, synth, first, last, batch, sample_rate, effects)
+        _master_and_write(synth, full_wave, output_file, sample_rate, peak)
+    elif stream:
+        with synth._stage("render"):
+            stream_music(timeline, synth, output_file, block_size, sample_rate=sample_rate, effects=effects)
+    else:
+        if workers:
+            synth_options = {"sample_rate": rate, "oscillator": oscillator,
+                             "interpolation": interpolation, "note_cache_bytes": note_cache_bytes,
+                             "dtype": synth.dtype, "percussion": synth.percussion,
+                             "noise_bank_bytes": synth.noise_bank.max_bytes if synth.noise_bank else 0,
+                             "quality": quality}
+            with synth._stage("render"):
+                full_wave = render_parallel(timeline, workers, synth_options, buses)
+        elif stem_cache_dir:
+            stem_cache = StemCache(stem_cache_dir, stem_cache_bytes)
+            with synth._stage("render"):
+                full_wave = render_with_stems(score.to_config(), synth, stem_cache, seed, batch, buses)
+            print(f"Stem cache: {stem_cache.hits} reused, {stem_cache.misses} rendered")
+        elif loop_bake:
+            with synth._stage("render"):
+                full_wave = render_loops(timeline, loops, synth, batch, buses)
+        else:
+            with synth._stage("render"):
+                full_wave = render_timeline(timeline, synth, batch=batch, buses=buses)
+        if effects is not None:
+            with synth._stage("effects"):
+                full_wave = effects.process(full_wave)
+        if rate != sample_rate:
+            with synth._stage("resample"):
+                full_wave = resample(full_wave, rate, sample_rate)
+        _master_and_write(synth, full_wave, output_file, sample_rate)
     print(f"Advanced music saved as '{output_file}'")
+    if profiler is not None:
+        # Worker processes have their own synthesizers, so workers=N only
+        # reports the stages run in this process.
+        synth.profiler = previous_profiler
+        report = dict(profiler.report(), config=json_file, output=output_file, sample_rate=sample_rate,
+                      total_duration=total_duration, wall_time=time.perf_counter() - started)
+        if note_cache is not None and not workers:
+            report["note_cache"] = note_cache.stats()
+        report["envelopes"] = synth.envelopes.stats()
+        if synth.noise_bank is not None and not workers:
+            report["noise_bank"] = synth.noise_bank.stats()
+        if profile:
+            with open(profile, "w") as f:
+                json.dump(report, f, indent=2)
+        if profile_trace:
+            with open(profile_trace, "w") as f:
+                json.dump(profiler.chrome_trace(), f)
+        print(f"Profile ({report['wall_time']:.3f}s):\n{profiler.summary()}")
+    if workers:
+        return  # cache statistics live in the worker processes
+    if note_cache is not None:
+        stats = note_cache.stats()
+        print(f"Note cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['bytes_used'] / 1e6:.1f} MB used")
+    stats = synth.envelopes.stats()
+    print(f"Envelope table: {stats['envelopes']} envelopes, {stats['bytes_used'] / 1e6:.1f} MB, "
+          f"{stats['allocations_saved']} allocations saved")
+    if synth.noise_bank is not None:
+        stats = synth.noise_bank.stats()
+        print(f"Noise bank: {stats['windows']} windows, {stats['fallbacks']} fresh draws, "
+              f"{stats['bytes_used'] / 1e6:.1f} MB")
+
+DEFAULT_VARIATION_BYTES = 512 * 1024 * 1024  # mix buses of the takes rendered together
+
+def create_variations(json_file, output_pattern="take_{take:02d}.wav", takes=10, seed=None,
+                      note_cache_bytes=DEFAULT_NOTE_CACHE_BYTES, batch=False, oscillator="sine",
+                      interpolation="linear", synth=None, dtype=np.float64, percussion="notes", noise_bank_bytes=0,
+                      quality="normal", max_bytes=DEFAULT_VARIATION_BYTES):
+    # Writes `takes` humanized takes of one config to output_pattern.format(take=i),
+    # i from 1. Take i is compiled with seed [entropy, i] and the noise seed
+    # `entropy` of SeedSequence(seed), so takes differ in onsets and volumes
+    # but not in their notes, which render_variations synthesizes once for
+    # every take mixed together. As many takes as fit in max_bytes of mix
+    # buses are mixed at a time. Returns [(output file, timeline seed)].
+    score, synth, effects = _prepare_render(json_file, synth, note_cache_bytes, oscillator, interpolation, dtype,
+                                            percussion, noise_bank_bytes, quality)
+    sample_rate = score.settings.get("sample_rate", 44100)
+    rate = synth.sample_rate
+    buses = effects.names if effects is not None else ()
+    entropy = np.random.SeedSequence(seed).entropy
+    seeds = [[entropy, take] for take in range(1, takes + 1)]
+    rows = ((1 + len(buses)) * int(rate * score.settings["total_duration"])
+            * output_channels(score.settings, score.instruments) * synth.dtype.itemsize)
+    group = max(1, min(takes, max_bytes // max(rows, 1)))
+    outputs = []
+    for first in range(0, takes, group):
+        with synth._stage("compile"):
+            timelines = [compile_timeline(score, rate, take_seed, entropy) for take_seed in seeds[first:first + group]]
+        with synth._stage("render"):
+            mix = render_variations(timelines, synth, batch=batch, buses=buses)
+        for take, timeline in enumerate(timelines, first + 1):
+            full_wave = mix[take - first - 1]
+            if effects is not None:
+                effects.reset()
+                with synth._stage("effects"):
+                    full_wave = effects.process(full_wave)
+            else:
+                full_wave = full_wave[0]
+            if rate != sample_rate:
+                with synth._stage("resample"):
+                    full_wave = resample(full_wave, rate, sample_rate)
+            output_file = output_pattern.format(take=take)
+            _master_and_write(synth, full_wave, output_file, sample_rate)
+            outputs.append((output_file, timeline.seed))
+        del mix
+    print(f"{takes} variations saved as '{output_pattern}'")
+    return outputs
 
 if __name__ == "__main__":
-    json_file = "track.json"
-    create_advanced_music(json_file)
\ No newline at end of file
+    json_file = sys.argv[1] if len(sys.argv) > 1 else "track.json"
+    output_file = sys.argv[2] if len(sys.argv) > 2 else "advanced_output.wav"
+    create_advanced_music(json_file, output_file)
\ No newline at end of file
@@ -0,0 +1,96 @@
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Load test for render_server.py. Sends --requests renders of one config with
+# --concurrency clients in flight and reports latency percentiles, time to
+# first byte and throughput.
+#
+#   python render_server.py --workers 2 &
+#   python load_test.py track.json --requests 40 --concurrency 4
+
+def render(host, port, body, seed, priority):
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection(host, port, timeout=600)
+    try:
+        connection.request("POST", f"/render?seed={seed}&priority={priority}", body,
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        first_chunk = response.read(4096)
+        first_byte = time.perf_counter() - start
+        received = len(first_chunk) + len(response.read())
+        if response.status != 200:
+            return {"status": response.status, "latency": time.perf_counter() - start}
+        return {"status": 200, "latency": time.perf_counter() - start, "first_byte": first_byte, "bytes": received}
+    except (OSError, http.client.HTTPException) as e:
+        return {"status": None, "error": f"{type(e).__name__}: {e}", "latency": time.perf_counter() - start}
+    finally:
+        connection.close()
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"p50": float(p50), "p99": float(p99), "max": max(values)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running render server.")
+    parser.add_argument("config", help="JSON config to render on every request")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, help="override the config's total_duration")
+    parser.add_argument("--distinct-seeds", action="store_true", help="use a different seed per request")
+    parser.add_argument("--out", help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+    if args.duration is not None:
+        config["total_duration"] = args.duration
+    body = json.dumps(config).encode()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(render, args.host, args.port, body, index if args.distinct_seeds else 0, 10)
+                   for index in range(args.requests)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    ok = [result for result in results if result["status"] == 200]
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_time": elapsed,
+        "requests_per_s": len(ok) / elapsed,
+        "audio_seconds_per_s": len(ok) * config["total_duration"] / elapsed,
+        "latency_s": percentiles([result["latency"] for result in ok]),
+        "first_byte_s": percentiles([result["first_byte"] for result in ok]),
+        "mean_bytes": statistics.mean(result["bytes"] for result in ok) if ok else 0,
+    }
+    print(f"{len(ok)}/{args.requests} ok in {elapsed:.2f}s: {report['requests_per_s']:.2f} req/s, "
+          f"{report['audio_seconds_per_s']:.1f} audio s/s")
+    for name in ("latency_s", "first_byte_s"):
+        values = report[name]
+        if values["p50"] is not None:
+            print(f"{name:<14} p50 {values['p50'] * 1e3:8.1f} ms   p99 {values['p99'] * 1e3:8.1f} ms"
+                  f"   max {values['max'] * 1e3:8.1f} ms")
+    errors = {result.get("error") or result["status"] for result in results if result["status"] != 200}
+    for error in errors:
+        print(f"Failure: {error}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if len(ok) < len(results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import argparse
+import io
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy import signal, stats
+
+import gg
+
+# Statistics and speed of the shared noise bank against fresh Gaussian draws.
+#
+#   python noise_compare.py                     # 32 MB bank
+#   python noise_compare.py --bank-mb 8
+#
+# Checks that the bank is unit Gaussian and white, that the windows notes get
+# from a real timeline rarely share samples with notes sounding at the same
+# time (shared samples would be heard as repetition), and times render_note
+# and a full render both ways.
+
+NOISY = ["violin", "cello", "acoustic_guitar", "bass", "electric_guitar", "drum_snare", "drum_kick"]
+DURATIONS = [0.05, 0.25, 1.0]
+
+def bank_statistics(bank, dtype=np.float64):
+    buffer = bank.buffer(dtype).astype(np.float64)
+    sample = buffer[::max(1, len(buffer) // 200000)]
+    lags = np.arange(1, 65)
+    autocorrelation = [float(np.dot(buffer[:-lag], buffer[lag:]) / (len(buffer) - lag)) for lag in lags]
+    _, psd = signal.welch(buffer, nperseg=4096)
+    psd = psd[1:-1]  # DC and Nyquist bins have half the degrees of freedom
+    return {
+        "samples": len(buffer),
+        "seconds_at_44100": len(buffer) / 44100,
+        "mean": float(buffer.mean()),
+        "std": float(buffer.std()),
+        "skewness": float(stats.skew(sample)),
+        "excess_kurtosis": float(stats.kurtosis(sample)),
+        "ks_pvalue": float(stats.kstest(sample, "norm").pvalue),
+        "max_abs_autocorrelation": float(np.max(np.abs(autocorrelation))),
+        "psd_ripple_db": float(10 * np.log10(psd.max() / psd.min())),
+    }
+
+def repetition(bank, config, seed=1):
+    # For notes sounding at the same time, how often their noise windows
+    # share bank samples, against the rate expected from uniform offsets, and
+    # the largest shared fraction of the shorter note
+    events = gg.compile_timeline(config, seed=seed).events
+    span = len(bank.buffer()) - events["n_samples"]
+    windows = (events["noise_seed"] % (span + 1).astype(np.uint64)).astype(np.int64)
+    starts, lengths = events["start_sample"], events["n_samples"]
+    pairs = shared = 0
+    expected = worst = 0.0
+    for index in range(len(events)):
+        # later notes that start before this one ends
+        later = np.arange(index + 1, np.searchsorted(starts, starts[index] + lengths[index]))
+        pairs += len(later)
+        # windows at uniform offsets overlap with probability (n1 + n2) / span
+        expected += float(np.minimum(1, (lengths[index] + lengths[later]) / (span[later] + 1)).sum())
+        overlap = (np.minimum(windows[index] + lengths[index], windows[later] + lengths[later])
+                   - np.maximum(windows[index], windows[later]))
+        hits = overlap > 0
+        shared += int(hits.sum())
+        if hits.any():
+            worst = max(worst, float((overlap[hits] / np.minimum(lengths[index], lengths[later][hits])).max()))
+    return {"notes": len(events), "simultaneous_pairs": pairs, "pairs_sharing_samples": shared,
+            "expected_sharing_pairs": expected, "max_shared_fraction": worst}
+
+def time_notes(bank, repeats=200):
+    rows = []
+    fresh = gg.RealisticInstrumentSynthesizer()
+    banked = gg.RealisticInstrumentSynthesizer(noise_bank=bank)
+    seeds = np.random.default_rng(0).integers(0, 2 ** 63, repeats).tolist()
+    for instrument_type in ("violin", "drum_snare"):
+        for duration in DURATIONS:
+            kind, build, pitched = fresh.voice(instrument_type)
+            try:
+                parts = fresh._note_parts(kind, 440.0 if pitched else None, duration, build)
+            except ValueError:
+                continue  # envelope longer than the note
+            row = {"voice": instrument_type, "duration": duration}
+            for name, synth in (("fresh", fresh), ("bank", banked)):
+                start = time.perf_counter()
+                for seed in seeds:
+                    synth.render_note(parts, 0.8, seed)
+                row[f"{name}_us"] = (time.perf_counter() - start) / repeats * 1e6
+            row["speedup"] = row["fresh_us"] / row["bank_us"]
+            rows.append(row)
+    return rows
+
+def time_render(bank_bytes, config, repeats=3):
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = os.path.join(workdir, "noisy.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        result = {}
+        for name, size in (("fresh", 0), ("bank", bank_bytes)):
+            synth = gg.RealisticInstrumentSynthesizer(
+                config["sample_rate"], note_cache=gg.NoteCache(),
+                noise_bank=gg.NoiseBank(size) if size else None)
+            best = float("inf")
+            for _ in range(repeats + 1):  # the first run fills the caches and the bank
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    gg.create_advanced_music(config_path, os.path.join(workdir, "out.wav"), seed=1, synth=synth)
+                best = min(best, time.perf_counter() - start)
+            result[f"{name}_s"] = best
+    result["speedup"] = result["fresh_s"] / result["bank_s"]
+    return result
+
+def noisy_config(total_duration=120):
+    # Short notes on every instrument with a noise component
+    notes = ["C3", "E3", "G3", "B3", "D4", "F4", "A4", "C5"]
+    instruments = []
+    for index, instrument_type in enumerate(NOISY):
+        duration = 0.5 if instrument_type.startswith("drum") else 0.35
+        pattern = [{"note": notes[(index + step) % len(notes)], "duration": duration} for step in range(8)]
+        instruments.append({"type": instrument_type, "volume": 0.4, "pattern": pattern, "repeat": True})
+    return {"tempo": 120, "total_duration": total_duration, "sample_rate": 44100, "instruments": instruments}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and time the shared noise bank.")
+    parser.add_argument("--bank-mb", type=float, default=gg.DEFAULT_NOISE_BANK_BYTES / (1024 * 1024))
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+    bank_bytes = int(args.bank_mb * 1024 * 1024)
+    bank = gg.NoiseBank(bank_bytes)
+    config = noisy_config()
+
+    results = {"bank_bytes": bank_bytes, "statistics": bank_statistics(bank),
+               "repetition": repetition(bank, config), "notes": time_notes(bank),
+               "render": time_render(bank_bytes, config)}
+    statistics = results["statistics"]
+    print(f"Bank: {statistics['samples']} samples ({statistics['seconds_at_44100']:.0f} s at 44.1 kHz)")
+    print(f"  mean {statistics['mean']:+.5f}  std {statistics['std']:.5f}  skewness {statistics['skewness']:+.4f}"
+          f"  excess kurtosis {statistics['excess_kurtosis']:+.4f}  KS p-value {statistics['ks_pvalue']:.3f}")
+    print(f"  max |autocorrelation| (lags 1-64) {statistics['max_abs_autocorrelation']:.5f}"
+          f"  PSD ripple {statistics['psd_ripple_db']:.2f} dB")
+    shared = results["repetition"]
+    print(f"Repetition: {shared['pairs_sharing_samples']} of {shared['simultaneous_pairs']} simultaneous note pairs"
+          f" share bank samples ({shared['expected_sharing_pairs']:.0f} expected at random offsets,"
+          f" largest shared fraction {shared['max_shared_fraction']:.2f})")
+    print(f"{'voice':<12}{'duration':>9}{'fresh us':>10}{'bank us':>9}{'speedup':>9}")
+    for row in results["notes"]:
+        print(f"{row['voice']:<12}{row['duration']:>9.2f}{row['fresh_us']:>10.1f}{row['bank_us']:>9.1f}"
+              f"{row['speedup']:>8.1f}x")
+    render = results["render"]
+    print(f"Render of {len(config['instruments'])} noisy instruments x {config['total_duration']} s: "
+          f"{render['fresh_s']:.3f} s fresh, {render['bank_s']:.3f} s with the bank ({render['speedup']:.1f}x)")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import gg
+
+# Long-running render service around gg.stream_music.
+#
+#   python render_server.py --port 8765 --workers 2
+#   curl -o out.wav --data-binary @track.json "http://127.0.0.1:8765/render?seed=1"
+#
+# POST /render          body: JSON config; query: seed, priority (lower runs
+#                       first, default 10), id, oscillator, interpolation, dtype,
+#                       percussion, quality
+#                       Streams the WAV back with chunked transfer encoding.
+# DELETE /render/<id>   cancels a queued or running render
+# GET /status           queue, running renders and cache statistics
+#
+# Renders run on a fixed pool of worker threads, each with its own
+# synthesizers, so note and envelope caches stay warm between requests. The
+# WAV header carries the final length, and blocks are sent as the second
+# streaming pass masters them.
+# Configs that play recorded samples are refused (400).
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_PRIORITY = 10
+CHUNK_BACKLOG = 8  # blocks buffered per response before the renderer waits
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_SYNTHS_PER_WORKER = 4  # least recently used settings are dropped beyond this
+
+class RenderCancelled(Exception):
+    pass
+
+class RenderJob:
+    def __init__(self, job_id, config, priority, options, loop):
+        self.id = job_id
+        self.config = config
+        self.priority = priority
+        self.options = options
+        self.chunks = asyncio.Queue(CHUNK_BACKLOG)
+        self.cancelled = threading.Event()
+        self.state = "queued"
+        self.progress = 0.0
+        self.submitted = time.perf_counter()
+        self.loop = loop
+
+    def emit(self, item):
+        # Called from a worker thread; waits for room in the chunk queue but
+        # gives up once the job is cancelled (e.g. the client went away).
+        future = asyncio.run_coroutine_threadsafe(self.chunks.put(item), self.loop)
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except concurrent.futures.TimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise RenderCancelled()
+
+class _ChunkSink:
+    # File-like target for gg.WavWriter that forwards each write to a job
+    def __init__(self, job):
+        self.job = job
+
+    def write(self, data):
+        self.job.emit(bytes(data))
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+class RenderServer:
+    def __init__(self, workers=2, queue_size=DEFAULT_QUEUE_SIZE, note_cache_bytes=gg.DEFAULT_NOTE_CACHE_BYTES,
+                 block_size=gg.DEFAULT_BLOCK_SIZE, envelope_bytes=gg.DEFAULT_ENVELOPE_TABLE_BYTES,
+                 max_synths=MAX_SYNTHS_PER_WORKER):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.note_cache_bytes = note_cache_bytes
+        self.block_size = block_size
+        self.envelope_bytes = envelope_bytes
+        self.max_synths = max(1, max_synths)
+        self.jobs = {}
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._queue = None
+        self._sequence = itertools.count()
+        self._ids = itertools.count(1)
+        self._synths = [OrderedDict() for _ in range(workers)]
+        self.synth_evictions = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+
+    def synth(self, worker, sample_rate, options):
+        # One synthesizer per worker thread and settings; never shared between
+        # threads. Each worker keeps its max_synths most recently used ones.
+        key = (sample_rate, options["oscillator"], options["interpolation"], options["dtype"], options["percussion"],
+               options["quality"])
+        synths = self._synths[worker]
+        synth = synths.get(key)
+        if synth is not None:
+            synths.move_to_end(key)
+        else:
+            note_cache = gg.NoteCache(self.note_cache_bytes) if self.note_cache_bytes else None
+            synth = gg.RealisticInstrumentSynthesizer(sample_rate, note_cache=note_cache,
+                                                      envelopes=gg.EnvelopeTable(self.envelope_bytes),
+                                                      oscillator=options["oscillator"],
+                                                      interpolation=options["interpolation"],
+                                                      dtype=options["dtype"],
+                                                      percussion=options["percussion"],
+                                                      quality=options["quality"])
+            synths[key] = synth
+            while len(synths) > self.max_synths:
+                synths.popitem(last=False)
+                self.synth_evictions += 1
+        return synth
+
+    def _render(self, worker, job):
+        # Runs in a worker thread
+        sample_rate = job.config.get("sample_rate", 44100)
+        rate = gg.render_rate(sample_rate, job.options["quality"])
+        synth = self.synth(worker, rate, job.options)
+        # Inline instrument specs and generated reverbs only: a request cannot
+        # name files on the server
+        timeline = gg.compile_timeline(job.config, rate, job.options["seed"])
+        effects = gg.EffectsBus.from_settings(job.config.get("effects"), rate, channels=timeline.channels)
+
+        def progress(pass_number, done, total):
+            if job.cancelled.is_set():
+                raise RenderCancelled()
+            job.progress = (pass_number - 1 + done / max(total, 1)) / 2
+
+        gg.stream_music(timeline, synth, _ChunkSink(job), self.block_size, progress, sample_rate, effects)
+
+    async def _worker(self, worker):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if job.cancelled.is_set():
+                    continue
+                job.state = "running"
+                try:
+                    await loop.run_in_executor(self._executor, self._render, worker, job)
+                except RenderCancelled:
+                    job.state = "cancelled"
+                    self.cancelled += 1
+                except Exception as e:
+                    job.state = "error"
+                    self.failed += 1
+                    if not job.cancelled.is_set():
+                        await job.chunks.put(e)
+                else:
+                    job.state = "done"
+                    self.completed += 1
+                    if not job.cancelled.is_set():
+                        await job.chunks.put(None)
+            finally:
+                if job.cancelled.is_set() and job.state == "queued":
+                    job.state = "cancelled"
+                    self.cancelled += 1
+                self.jobs.pop(job.id, None)
+                self._queue.task_done()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled.set()
+        # Wake a response still waiting for its first chunk
+        if job.chunks.empty():
+            job.chunks.put_nowait(RenderCancelled())
+        return True
+
+    def status(self):
+        caches = []
+        cache_bytes = 0
+        for worker, synths in enumerate(self._synths):
+            # list(): a worker thread may add or drop a synthesizer meanwhile
+            for (sample_rate, oscillator, interpolation, dtype, percussion, quality), synth in list(synths.items()):
+                if synth.note_cache is not None:
+                    cache_bytes += synth.note_cache.bytes_used
+                cache_bytes += synth.envelopes.bytes_used
+                caches.append({
+                    "worker": worker,
+                    "sample_rate": sample_rate,
+                    "oscillator": oscillator,
+                    "interpolation": interpolation,
+                    "dtype": dtype,
+                    "percussion": percussion,
+                    "quality": quality,
+                    "note_cache": synth.note_cache.stats() if synth.note_cache is not None else None,
+                    "envelopes": synth.envelopes.stats(),
+                })
+        return {
+            "workers": self.workers,
+            "queued": sum(job.state == "queued" for job in self.jobs.values()),
+            "running": [{"id": job.id, "priority": job.priority, "progress": job.progress}
+                        for job in self.jobs.values() if job.state == "running"],
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "caches": caches,
+            "cache_bytes": cache_bytes,
+            "max_synths_per_worker": self.max_synths,
+            "synth_evictions": self.synth_evictions,
+        }
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    def _options(self, query):
+        def value(name, default):
+            return query.get(name, [default])[0]
+        options = {
+            "seed": int(value("seed", 0)),
+            "oscillator": value("oscillator", "sine"),
+            "interpolation": value("interpolation", "linear"),
+            "dtype": value("dtype", "float64"),
+            "percussion": value("percussion", "notes"),
+            "quality": value("quality", "normal"),
+        }
+        if options["oscillator"] not in ("sine", "wavetable"):
+            raise ValueError(f"Unknown oscillator '{options['oscillator']}'")
+        if options["interpolation"] not in ("linear", "cubic"):
+            raise ValueError(f"Unknown interpolation '{options['interpolation']}'")
+        if options["dtype"] not in ("float64", "float32"):
+            raise ValueError(f"Unsupported dtype '{options['dtype']}'")
+        if options["percussion"] not in ("notes", "trains"):
+            raise ValueError(f"Unknown percussion mode '{options['percussion']}'")
+        if options["quality"] not in gg.QUALITY_LEVELS:
+            raise ValueError(f"Unknown quality '{options['quality']}'")
+        return options, int(value("priority", DEFAULT_PRIORITY)), value("id", None)
+
+    async def _handle_render(self, writer, query, body):
+        try:
+            config = json.loads(body)
+            if not isinstance(config, dict) or "total_duration" not in config or "instruments" not in config:
+                raise ValueError("Config needs 'total_duration' and 'instruments'")
+            if gg.uses_samples(config):
+                # Sample paths would name files on the server's disk
+                raise ValueError("Sampled instruments are not served")
+            options, priority, job_id = self._options(query)
+        except (ValueError, KeyError, TypeError) as e:
+            await self._respond(writer, "400 Bad Request", {"error": f"{type(e).__name__}: {e}"})
+            return
+        job_id = job_id or str(next(self._ids))
+        if job_id in self.jobs:
+            await self._respond(writer, "409 Conflict", {"error": f"Render '{job_id}' already exists"})
+            return
+        if self._queue.qsize() >= self.queue_size:
+            await self._respond(writer, "503 Service Unavailable", {"error": "Render queue is full"})
+            return
+        job = RenderJob(job_id, config, priority, options, asyncio.get_running_loop())
+        self.jobs[job_id] = job
+        self._queue.put_nowait((priority, next(self._sequence), job))
+
+        started = False
+        try:
+            while True:
+                item = await job.chunks.get()
+                if item is None:
+                    break
+                if isinstance(item, RenderCancelled):
+                    if not started:
+                        await self._respond(writer, "409 Conflict", {"error": "Render cancelled", "id": job_id})
+                    return
+                if isinstance(item, Exception):
+                    if not started:
+                        await self._respond(writer, "500 Internal Server Error",
+                                            {"error": f"{type(item).__name__}: {item}", "id": job_id})
+                    return  # closing without the final chunk marks the body incomplete
+                if not started:
+                    writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: audio/wav\r\nTransfer-Encoding: chunked\r\n"
+                                 f"X-Render-Id: {job_id}\r\nConnection: close\r\n\r\n".encode())
+                    started = True
+                writer.write(f"{len(item):x}\r\n".encode() + item + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            job.cancelled.set()  # the client went away; stop rendering for it
+            raise
+        finally:
+            if job.state == "queued":
+                job.cancelled.set()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            method, target, headers, body = request
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            if method == "POST" and url.path == "/render":
+                await self._handle_render(writer, query, body)
+            elif method == "DELETE" and url.path.startswith("/render/"):
+                job_id = url.path[len("/render/"):]
+                if self.cancel(job_id):
+                    await self._respond(writer, "200 OK", {"cancelled": job_id})
+                else:
+                    await self._respond(writer, "404 Not Found", {"error": f"No render '{job_id}'"})
+            elif method == "GET" and url.path == "/status":
+                await self._respond(writer, "200 OK", self.status())
+            else:
+                await self._respond(writer, "404 Not Found", {"error": f"No route for {method} {url.path}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Error handling request: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self._queue = asyncio.PriorityQueue()
+        workers = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Render server listening on http://{host}:{port} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in workers:
+                task.cancel()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve music renders over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--block-size", type=int, default=gg.DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--note-cache-mb", type=int, default=gg.DEFAULT_NOTE_CACHE_BYTES // (1024 * 1024))
+    parser.add_argument("--envelope-mb", type=int, default=gg.DEFAULT_ENVELOPE_TABLE_BYTES // (1024 * 1024))
+    parser.add_argument("--max-synths", type=int, default=MAX_SYNTHS_PER_WORKER,
+                        help="synthesizer settings kept per worker")
+    args = parser.parse_args(argv)
+    server = RenderServer(max(1, args.workers), args.queue_size, args.note_cache_mb * 1024 * 1024, args.block_size,
+                          args.envelope_mb * 1024 * 1024, args.max_synths)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
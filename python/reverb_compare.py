@@ -0,0 +1,70 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+from scipy.signal import fftconvolve, oaconvolve
+
+import gg
+from benchmark import best_of
+
+# Cost and accuracy of the partitioned convolution reverb against direct and
+# whole-signal FFT convolution on a 3-second impulse response.
+#
+#   python reverb_compare.py                    # 30 s of input
+#   python reverb_compare.py --seconds 120 --naive-seconds 2
+#
+# np.convolve is timed on a shorter input (--naive-seconds), since its cost
+# grows with input length times IR length; its realtime factor is comparable.
+# ConvolutionReverb is fed render-sized blocks, the way stream_music uses it.
+
+SAMPLE_RATE = 44100
+IR_SECONDS = 3.0
+PARTITIONS = [1024, 4096, 8192, 16384]
+
+def partitioned(ir, partition, x, block_size):
+    reverb = gg.ConvolutionReverb(ir, partition)
+    return np.concatenate([reverb.process(x[begin:begin + block_size]) for begin in range(0, len(x), block_size)])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the partitioned convolution reverb with direct convolution.")
+    parser.add_argument("--seconds", type=float, default=30.0, help="input length")
+    parser.add_argument("--naive-seconds", type=float, default=1.0, help="input length for np.convolve")
+    parser.add_argument("--block-size", type=int, default=gg.DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    ir = gg.reverb_ir(SAMPLE_RATE, decay=2.5, length=IR_SECONDS)
+    x = np.random.default_rng(0).standard_normal(int(SAMPLE_RATE * args.seconds))
+    short = x[:int(SAMPLE_RATE * args.naive_seconds)]
+    reference = fftconvolve(x, ir)[:len(x)]
+
+    cases = [
+        ("np.convolve", args.naive_seconds, lambda: np.convolve(short, ir)[:len(short)], None),
+        ("fftconvolve", args.seconds, lambda: fftconvolve(x, ir)[:len(x)], "whole signal in memory"),
+        ("oaconvolve", args.seconds, lambda: oaconvolve(x, ir)[:len(x)], "whole signal in memory"),
+    ]
+    for partition in PARTITIONS:
+        cases.append((f"partitioned {partition}", args.seconds,
+                      lambda partition=partition: partitioned(ir, partition, x, args.block_size),
+                      f"blocks of {args.block_size}"))
+
+    rows = []
+    print(f"IR {IR_SECONDS:.0f} s ({len(ir)} samples), input {args.seconds:g} s at {SAMPLE_RATE} Hz")
+    print(f"{'method':<20}{'input s':>8}{'time s':>9}{'realtime':>10}{'max error':>11}")
+    for name, seconds, function, note in cases:
+        elapsed, y = best_of(function, 1 if name == "np.convolve" else args.repeats)
+        error = float(np.abs(y - reference[:len(y)]).max())
+        row = {"method": name, "input_seconds": seconds, "seconds": elapsed, "realtime_factor": seconds / elapsed,
+               "max_error": error, "note": note}
+        rows.append(row)
+        print(f"{name:<20}{seconds:>8g}{elapsed:>9.3f}{row['realtime_factor']:>9.1f}x{error:>11.1e}"
+              + (f"  ({note})" if note else ""))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"ir_seconds": IR_SECONDS, "sample_rate": SAMPLE_RATE, "results": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.io.wavfile import read as read_wav
+
+import gg
+from benchmark import best_of
+
+# Cost of the sampler instrument against the additive instruments: opening a
+# multisample library, synthesizing one note and a full render.
+#
+#   python sampler_compare.py                     # 1 GB library in a temp dir
+#   python sampler_compare.py --library-mb 4096 --out sampler.json
+#
+# The library is one float32 WAV per minor third from C2 to C7: a decaying
+# harmonic tone padded with silence until the files add up to --library-mb.
+# Opening it is compared with reading every file into memory. Notes are timed
+# with the note cache off, so every sampler note is resampled from the file;
+# the first pass pages the recordings in, later passes find them in the OS
+# page cache.
+
+SAMPLE_RATE = 44100
+ROOTS = [f"{name}{octave}" for octave in range(2, 7) for name in ("C", "D#", "F#", "A")] + ["C7"]
+TONE_SECONDS = 4.0
+ADDITIVE = ["piano", "violin", "acoustic_guitar", "synth_pad"]
+NOTES = ["C2", "G2", "E3", "A#3", "C4", "F4", "B4", "D5", "G#5", "C6", "E6", "B6"]
+DURATIONS = [0.5, 1.0, 4.0]
+CHUNK = 1 << 20
+
+def build_library(directory, library_mb):
+    # One <root>.wav per root; returns the total size in bytes
+    frames = max(int(SAMPLE_RATE * TONE_SECONDS), library_mb * 1024 * 1024 // (4 * len(ROOTS)))
+    t = np.arange(int(SAMPLE_RATE * TONE_SECONDS)) / SAMPLE_RATE
+    for note in ROOTS:
+        freq = gg.NOTE_FREQ[note]
+        tone = sum(np.sin(2 * np.pi * freq * k * t) / k for k in range(1, 9) if freq * k < SAMPLE_RATE / 2)
+        tone *= 0.3 * np.exp(-1.5 * t)
+        with gg.WavWriter(os.path.join(directory, f"{note}.wav"), SAMPLE_RATE) as writer:
+            writer.write(tone)
+            for begin in range(len(tone), frames, CHUNK):
+                writer.write(np.zeros(min(CHUNK, frames - begin), np.float32))
+    return sum(os.path.getsize(os.path.join(directory, f"{note}.wav")) for note in ROOTS)
+
+def traced(function):
+    # (seconds, Python peak bytes) of one call; memory-mapped pages are not
+    # Python allocations, so they do not count
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def note_seconds(kernel, synth, repeats):
+    # Best time over every note and duration, and the first (cold) pass
+    def run():
+        for note in NOTES:
+            for duration in DURATIONS:
+                kernel.parts(synth, gg.NOTE_FREQ[note], duration)
+    start = time.perf_counter()
+    run()
+    cold = time.perf_counter() - start
+    return best_of(run, repeats)[0], cold
+
+def render_config(instrument_type, seconds, seed):
+    rng = np.random.default_rng(seed)
+    instruments = []
+    for _ in range(4):
+        pattern, total = [], 0.0
+        while total < seconds:
+            duration = float(rng.choice([0.5, 1.0, 2.0]))
+            pattern.append({"note": NOTES[int(rng.integers(len(NOTES)))], "duration": duration})
+            total += duration
+        instruments.append({"type": instrument_type, "volume": 0.5, "pattern": pattern})
+    return {"total_duration": seconds, "tempo": 120, "sample_rate": SAMPLE_RATE, "instruments": instruments}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the sampler instrument with the additive instruments.")
+    parser.add_argument("--library-mb", type=int, default=1024, help="total size of the generated library")
+    parser.add_argument("--render-seconds", type=float, default=60.0, help="length of the full-render config")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    results = {"library_mb": args.library_mb, "roots": len(ROOTS), "sample_rate": SAMPLE_RATE}
+    with tempfile.TemporaryDirectory() as directory:
+        library = os.path.join(directory, "library")
+        os.mkdir(library)
+        start = time.perf_counter()
+        size = build_library(library, args.library_mb)
+        print(f"library: {len(ROOTS)} roots, {size / 2**20:.0f} MB written in {time.perf_counter() - start:.1f} s")
+        spec = {"samples": library, "envelope": gg.SAMPLER_ENVELOPE}
+
+        load, load_peak = traced(lambda: gg.instrument_kernel(spec, "sampler"))
+        read, read_peak = traced(lambda: [read_wav(os.path.join(library, f"{note}.wav")) for note in ROOTS])
+        results["load"] = {"mmap_seconds": load, "mmap_peak_bytes": load_peak,
+                           "read_seconds": read, "read_peak_bytes": read_peak}
+        print(f"open (mmap) {load * 1000:9.2f} ms {load_peak / 2**20:8.1f} MB  "
+              f"read into memory {read * 1000:9.1f} ms {read_peak / 2**20:8.1f} MB")
+
+        synth = gg.RealisticInstrumentSynthesizer(SAMPLE_RATE, note_cache=None)
+        notes = len(NOTES) * len(DURATIONS)
+        rows = []
+        print(f"{'instrument':<18}{'ms/note':>9}{'cold ms':>9}{'vs sampler':>12}")
+        sampler, cold = note_seconds(gg.instrument_kernel(spec, "sampler"), synth, args.repeats)
+        rows.append({"instrument": "sampler", "ms_per_note": sampler / notes * 1000,
+                     "cold_ms_per_note": cold / notes * 1000})
+        for name in ADDITIVE:
+            best, cold = note_seconds(gg.instrument_kernel(gg.INSTRUMENT_SPECS[name], name), synth, args.repeats)
+            rows.append({"instrument": name, "ms_per_note": best / notes * 1000,
+                         "cold_ms_per_note": cold / notes * 1000})
+        for row in rows:
+            print(f"{row['instrument']:<18}{row['ms_per_note']:>9.3f}{row['cold_ms_per_note']:>9.3f}"
+                  f"{row['ms_per_note'] / rows[0]['ms_per_note']:>11.2f}x")
+        results["notes"] = rows
+
+        renders = []
+        for instrument_type in ["sampler", "piano"]:
+            config = render_config(instrument_type, args.render_seconds, 1)
+            if instrument_type == "sampler":
+                for instrument in config["instruments"]:
+                    instrument["samples"] = library
+            config_path = os.path.join(directory, f"{instrument_type}.json")
+            with open(config_path, "w") as f:
+                json.dump(config, f)
+            output = os.path.join(directory, "out.wav")
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, _ = best_of(lambda: gg.create_advanced_music(config_path, output, seed=1, batch=True),
+                                     args.repeats)
+            renders.append({"instrument": instrument_type, "seconds": elapsed,
+                            "realtime_factor": args.render_seconds / elapsed})
+            print(f"render {args.render_seconds:g} s of {instrument_type:<8}{elapsed:8.3f} s "
+                  f"{renders[-1]['realtime_factor']:8.1f}x realtime")
+        results["renders"] = renders
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
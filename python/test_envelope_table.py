@@ -0,0 +1,26 @@
+import numpy as np
+
+import gg
+
+# python -m pytest test_envelope_table.py
+
+def test_envelope_table_stays_under_its_limit():
+    # Every note length is new, so without eviction the table would hold
+    # about 40 MB of envelopes and time axes
+    table = gg.EnvelopeTable(max_bytes=4 * 1024 * 1024)
+    synth = gg.RealisticInstrumentSynthesizer(44100, note_cache=None, envelopes=table)
+    rng = np.random.default_rng(0)
+    for duration in rng.uniform(0.5, 2.0, 100).tolist():
+        synth.generate_piano(gg.NOTE_FREQ["C4"], duration, 0.8)
+        assert table.bytes_used <= table.max_bytes
+    stats = table.stats()
+    assert stats["max_bytes"] == 4 * 1024 * 1024
+    assert stats["evictions"] > 0
+    assert stats["bytes_used"] == sum(array.nbytes for array in table._entries.values())
+
+def test_evicted_envelopes_are_rebuilt_the_same():
+    table = gg.EnvelopeTable(max_bytes=1)
+    synth = gg.RealisticInstrumentSynthesizer(44100, note_cache=None, envelopes=table)
+    first = synth.generate_piano(gg.NOTE_FREQ["C4"], 1.0, 0.8)
+    assert table.stats()["envelopes"] == 0
+    np.testing.assert_array_equal(synth.generate_piano(gg.NOTE_FREQ["C4"], 1.0, 0.8), first)
@@ -0,0 +1,17 @@
+import gg
+
+# python -m pytest test_stem_cache.py
+
+def _render(tmp_path, name, **options):
+    output = str(tmp_path / name)
+    gg.create_advanced_music("track.json", output, seed=1, **options)
+    with open(output, "rb") as f:
+        return f.read()
+
+def test_stem_cache_dir_with_stream(tmp_path):
+    expected = _render(tmp_path, "plain.wav", stream=True)
+    assert _render(tmp_path, "stems.wav", stream=True, stem_cache_dir=str(tmp_path / "stems")) == expected
+
+def test_stem_cache_dir_with_workers(tmp_path):
+    expected = _render(tmp_path, "plain.wav", workers=2)
+    assert _render(tmp_path, "stems.wav", workers=2, stem_cache_dir=str(tmp_path / "stems")) == expected